@@ -0,0 +1,112 @@
+"""Loopback echo benchmark for BFFramingProtocol
+
+Compares BFFramingProtocol against a hand written StreamReader framing loop,
+both echoing BFLength framed messages over a local TCP connection.
+
+    poetry run python benchmarks/bench_asyncio.py --messages 100000 --size 64
+"""
+
+import argparse
+import asyncio
+import struct
+import time
+
+from bitfactory import (
+    BFBuffer,
+    BFContainer,
+    BFEndian,
+    BFFramingProtocol,
+    BFLength,
+    BFStreamReader,
+    BFUInt8,
+    BFUInt16,
+)
+
+
+def make_schema():
+    schema = BFContainer()
+    schema.type = BFUInt8(value=1)
+    schema.body = BFLength(BFUInt16(endian=BFEndian.BIG), BFContainer())
+    schema.body.payload = BFBuffer()
+    return schema
+
+
+def make_message(size):
+    message = make_schema()
+    message.body.payload = BFBuffer(value=b"x" * size)
+    return message.pack()
+
+
+async def streamreader_echo(reader, writer):
+    """The hand written loop BFFramingProtocol replaces"""
+    try:
+        while True:
+            header = await reader.readexactly(3)
+            (size,) = struct.unpack(">H", header[1:])
+            body = await reader.readexactly(size)
+            writer.write(header + body)
+    except asyncio.IncompleteReadError:
+        writer.close()
+
+
+async def run_client(port, schema, message, count):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    start = time.perf_counter()
+
+    async def send():
+        batch = message * 256
+        for _ in range(count // 256):
+            writer.write(batch)
+            await writer.drain()
+        writer.write(message * (count % 256))
+        await writer.drain()
+
+    sender = asyncio.ensure_future(send())
+    received = 0
+    async for _ in BFStreamReader(reader, schema):
+        received += 1
+        if received == count:
+            break
+    elapsed = time.perf_counter() - start
+    await sender
+    writer.close()
+    await writer.wait_closed()
+    return elapsed
+
+
+async def bench(count, size):
+    loop = asyncio.get_running_loop()
+    schema = make_schema()
+    message = make_message(size)
+
+    servers = {
+        "BFFramingProtocol": await loop.create_server(
+            lambda: BFFramingProtocol(schema, lambda proto, frame: proto.send(frame)),
+            "127.0.0.1",
+            0,
+        ),
+        "StreamReader loop": await asyncio.start_server(
+            streamreader_echo, "127.0.0.1", 0
+        ),
+    }
+    for name, server in servers.items():
+        port = server.sockets[0].getsockname()[1]
+        elapsed = await run_client(port, schema, message, count)
+        server.close()
+        await server.wait_closed()
+        print(
+            f"{name:20} {count / elapsed:12,.0f} msg/s "
+            f"{count * len(message) / elapsed / 1e6:8.1f} MB/s"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--size", type=int, default=64, help="payload bytes")
+    args = parser.parse_args()
+    asyncio.run(bench(args.messages, args.size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Tree construction benchmark
+
+Times building a container through __setattr__ and add, and printing it,
+with tracing off, with tracing on but DEBUG logging disabled, and with the
+unguarded root logger logging.debug calls these methods made before
+set_trace existed. The last column is the cost every call used to pay.
+
+    poetry run python benchmarks/bench_construction.py --fields 100000
+"""
+
+import argparse
+import gc
+import logging
+import time
+
+from bitfactory import BFContainer, BFUInt16, set_trace
+from bitfactory.bitfactory import BFBasicDataType
+
+
+class UnguardedContainer(BFContainer):
+    """BFContainer making the logging.debug calls it made before set_trace"""
+
+    def add(self, name, obj):
+        root = name
+        sub_container = None
+        logging.debug(name)
+        if "." in root:
+            root, sub_container = root.split(".", 1)
+        logging.debug("%s : %s", root, sub_container)
+        logging.debug("Adding %s to %s (sub: %s)", type(obj), root, sub_container)
+        if sub_container is None and isinstance(obj, BFContainer):
+            logging.debug("SETTING NAME!!! %s", sub_container)
+        if root in self._children and sub_container is not None:
+            logging.debug("%s in children for this container", root)
+        else:
+            logging.debug("New child, Setting %s to %s", root, obj)
+        return super().add(name, obj)
+
+    def __setattr__(self, name, obj):
+        if isinstance(obj, BFBasicDataType) and not name.startswith("_"):
+            logging.debug("SETTER: %s", name)
+        super().__setattr__(name, obj)
+
+    def pretty_print(self, indent=0):
+        for child in self._children:
+            logging.debug("current child: %s (%s)", child, indent)
+        return super().pretty_print(indent)
+
+
+def build_setattr(count, cls=BFContainer):
+    container = cls()
+    for i in range(count):
+        setattr(container, f"f{i}", BFUInt16(value=i))
+    return container
+
+
+def build_add(count, cls=BFContainer):
+    container = cls()
+    container.add("sub", cls())
+    for i in range(count):
+        container.add(f"sub.f{i}", BFUInt16(value=i))
+    return container
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(count, repeat, cls=BFContainer):
+    printed = build_setattr(count, cls)
+    return {
+        "__setattr__": best_of(repeat, build_setattr, count, cls),
+        "add": best_of(repeat, build_add, count, cls),
+        "pretty_print": best_of(repeat, printed.pretty_print),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fields", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.getLogger("bitfactory").setLevel(logging.WARNING)
+
+    set_trace(False)
+    untraced = run(args.fields, args.repeat)
+    set_trace(True)
+    traced = run(args.fields, args.repeat)
+    set_trace(False)
+    unguarded = run(args.fields, args.repeat, UnguardedContainer)
+
+    print(f"{'':14} {'trace off':>12} {'trace on':>12} {'unguarded':>12}")
+    for label, elapsed in untraced.items():
+        print(
+            f"{label:14} {elapsed:11.3f}s {traced[label]:11.3f}s "
+            f"{unguarded[label]:11.3f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""BitFactory benchmark suite
+
+Runs pack, diff, construction, printing and memory benchmarks at a given number of
+fields and compares them against the baselines in baselines.json. Times are
+normalised per field, so baselines recorded at one scale apply to another.
+
+    poetry run python benchmarks/suite.py                    # compare
+    poetry run python benchmarks/suite.py --scale 1000000    # up to 10^6 fields
+    poetry run python benchmarks/suite.py --update           # record baselines
+    poetry run python benchmarks/suite.py -k pack            # only matching names
+
+Exits with status 1 if any benchmark is slower than its baseline by more
+than --threshold (a ratio, 1.5 by default).
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from bitfactory import (
+    BFBuffer,
+    BFCallableRef,
+    BFContainer,
+    BFLength,
+    BFUInt8,
+    BFUInt16,
+    BFUInt32,
+)
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+# Nesting depth of the deep and chained benchmarks, kept well under the
+# recursion limit so that the number of fields can grow to 10^6
+DEPTH = 64
+
+# Every BFCallableRef in a chain packs the levels below it again, doubling
+# the work per level, so the chain is kept short
+CHAIN_DEPTH = 6
+
+BENCHMARKS = {}
+
+
+def benchmark(unit):
+    """Register func(scale), which builds its data and returns what to time"""
+
+    def register(func):
+        BENCHMARKS[func.__name__] = (func, unit)
+        return func
+
+    return register
+
+
+def csum(data):
+    return sum(data) & 0xFFFF
+
+
+def wide(count):
+    container = BFContainer()
+    for i in range(count):
+        setattr(container, f"f{i}", BFUInt16(value=i))
+    return container
+
+
+def deep(count):
+    root = BFContainer()
+    node = root
+    per_level = max(count // DEPTH, 1)
+    for level in range(DEPTH):
+        for i in range(per_level):
+            setattr(node, f"f{i}", BFUInt32(value=i))
+        setattr(node, f"level{level}", BFContainer())
+        node = getattr(node, f"level{level}")
+    return root
+
+
+def length_chain(count):
+    """Nested BFLength bodies each with a checksum over the next level"""
+    root = BFContainer()
+    body = root
+    per_level = max(count // CHAIN_DEPTH, 1)
+    for _ in range(CHAIN_DEPTH):
+        body.csum = BFCallableRef(BFUInt16(), csum, "data")
+        body.data = BFContainer()
+        for i in range(per_level):
+            setattr(body.data, f"f{i}", BFUInt8(value=i))
+        body.data.inner = BFLength(BFUInt16(), BFContainer())
+        body = body.data.inner
+    return root
+
+
+@benchmark("field")
+def pack_wide(scale):
+    container = wide(scale)
+    return container.pack
+
+
+@benchmark("field")
+def pack_deep(scale):
+    container = deep(scale)
+    return container.pack
+
+
+@benchmark("field")
+def pack_length_chain(scale):
+    container = length_chain(scale)
+    return container.pack
+
+
+@benchmark("field")
+def pack_buffer(scale):
+    # 64 bytes of payload per "field"
+    container = BFContainer()
+    container.body = BFLength(BFUInt32(), BFContainer())
+    container.body.payload = BFBuffer(value=b"\xa5" * (64 * scale))
+    return container.pack
+
+
+@benchmark("field")
+def diff_wide(scale):
+    # One field in the middle changes before every diff, the first diff
+    # hashes both trees
+    container = wide(scale)
+    other = wide(scale)
+    container.diff(other)
+    field = getattr(other, f"f{scale // 2}")
+
+    def changed():
+        field.value = (field.value + 1) & 0xFFFF
+        return container.diff(other)
+
+    return changed
+
+
+@benchmark("field")
+def construct_setattr(scale):
+    return lambda: wide(scale)
+
+
+@benchmark("field")
+def construct_add(scale):
+    def build():
+        container = BFContainer()
+        container.add("sub", BFContainer())
+        for i in range(scale):
+            container.add(f"sub.f{i}", BFUInt16(value=i))
+
+    return build
+
+
+@benchmark("field")
+def pretty_print(scale):
+    container = deep(scale)
+    return container.pretty_print
+
+
+def time_benchmark(func, scale, repeat):
+    timed = func(scale)
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            timed()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best / scale
+
+
+def memory_per_leaf(scale):
+    """Peak bytes allocated per leaf while building a wide container"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        container = wide(scale)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del container
+    return peak / scale
+
+
+def run(scale, repeat, pattern):
+    results = {}
+    for name, (func, unit) in BENCHMARKS.items():
+        if pattern and pattern not in name:
+            continue
+        results[name] = (time_benchmark(func, scale, repeat) * 1e6, f"us/{unit}")
+    if not pattern or pattern in "memory_per_leaf":
+        results["memory_per_leaf"] = (memory_per_leaf(scale), "bytes/leaf")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=int, default=10000, help="fields")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threshold", type=float, default=1.5)
+    parser.add_argument("--baselines", default=BASELINES)
+    parser.add_argument("--update", action="store_true")
+    parser.add_argument("-k", dest="pattern", default="")
+    args = parser.parse_args()
+
+    results = run(args.scale, args.repeat, args.pattern)
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines, encoding="utf-8") as handle:
+            baselines = json.load(handle)
+
+    failed = []
+    print(f"{'benchmark':22} {'result':>21} {'baseline':>10} {'ratio':>7}")
+    for name, (value, unit) in results.items():
+        baseline = baselines.get(name)
+        if baseline:
+            ratio = value / baseline
+            status = ""
+            if ratio > args.threshold:
+                status = "  SLOWER"
+                failed.append(name)
+            print(
+                f"{name:22} {value:10.3f} {unit:10} {baseline:10.3f} "
+                f"{ratio:7.2f}{status}"
+            )
+        else:
+            print(f"{name:22} {value:10.3f} {unit:10} {'-':>10}")
+
+    if args.update:
+        baselines.update(
+            {name: round(value, 3) for name, (value, _) in results.items()}
+        )
+        with open(args.baselines, "w", encoding="utf-8") as handle:
+            json.dump(baselines, handle, indent=4, sort_keys=True)
+            handle.write("\n")
+        return 0
+
+    if failed:
+        print(f"Exceeded {args.threshold}x baseline: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,30 +1,54 @@
 """BitFactory Module imports"""
 from .bitfactory import (
+    BFArray,
+    BFBitField,
     BFBuffer,
     BFCallableRef,
     BFContainer,
+    BFDiff,
     BFEndian,
     BFLength,
     BFLengthRef,
+    BFOffsetRef,
+    BFPatch,
+    BFProfiler,
+    BFProfileStat,
     BFSInt8,
     BFSInt16,
     BFSInt32,
     BFUInt8,
     BFUInt16,
     BFUInt32,
+    BFVerifyError,
+    set_trace,
 )
+from .schema import BFSchemaCache
+from .stream import BFFramingProtocol, BFRecordReader, BFStreamReader
 
 __all__ = [
+    "BFArray",
+    "BFBitField",
     "BFBuffer",
     "BFContainer",
+    "BFDiff",
     "BFEndian",
+    "BFFramingProtocol",
     "BFLength",
     "BFLengthRef",
+    "BFOffsetRef",
+    "BFPatch",
     "BFCallableRef",
+    "BFProfiler",
+    "BFProfileStat",
+    "BFRecordReader",
+    "BFSchemaCache",
     "BFSInt8",
     "BFSInt16",
     "BFSInt32",
+    "BFStreamReader",
     "BFUInt8",
     "BFUInt16",
     "BFUInt32",
+    "BFVerifyError",
+    "set_trace",
 ]
@@ -1,12 +1,20 @@
+# pylint: disable=too-many-lines
 """BitFactory package
 """
 
 import abc
+import array
 import binascii
+import contextvars
 import logging
 import struct
+import sys
+import time
 from collections import OrderedDict
 from enum import Enum
+from itertools import compress
+from operator import ne
+from typing import NamedTuple
 
 from .exceptions import BFEndianException, BFRangeException, BFTypeException
 
@@ -22,12 +30,126 @@ class BFEndian(Enum):
     BIG = 2
 
 
+_LOGGER = logging.getLogger(__name__)
+
+# Tracing of tree construction and printing, see set_trace
+_TRACE = False
+
+# Sums of child hash terms in BFContainer.__hash__ are kept to 64 bits
+_HASH_MASK = (1 << 64) - 1
+
+# BFProfiler active in the current thread or task, see BFProfiler.__enter__
+_PROFILER = contextvars.ContextVar("bitfactory_profiler", default=None)
+
+# BFProfiler with a top-level pack in progress in the current thread or task
+_PROFILING = contextvars.ContextVar("bitfactory_profiling", default=None)
+
+
+def _pack_unprofiled(node):
+    """Pack node without recording it, for reads of computed values"""
+    if _PROFILER.get() is None:
+        return node.pack()
+    token = _PROFILER.set(None)
+    try:
+        return node.pack()
+    finally:
+        _PROFILER.reset(token)
+
+
+def set_trace(enabled=True):
+    """Turn tracing of BFContainer.add, __setattr__ and pretty_print on or off
+
+    Trace messages are logged at DEBUG level to the "bitfactory.bitfactory"
+    logger. While tracing is off those methods skip logging entirely.
+    """
+    global _TRACE  # pylint: disable=global-statement
+    _TRACE = enabled
+
+
+class BFVerifyError(NamedTuple):
+    """A single failure reported by BFContainer.verify"""
+
+    path: str
+    offset: int
+    reason: str
+
+
+class BFDiff(NamedTuple):
+    """A changed field reported by BFContainer.diff
+
+    offset/length locate the field in the first tree's packed bytes,
+    other_offset/other_length in the second's.
+    """
+
+    path: str
+    offset: int
+    length: int
+    other_offset: int
+    other_length: int
+
+
+class BFPatch(NamedTuple):
+    """Replace length bytes at offset with data"""
+
+    offset: int
+    length: int
+    data: bytes
+
+
+def _join_path(prefix, name):
+    if name is None:
+        return prefix
+    if not prefix:
+        return name
+    return prefix + "." + name
+
+
+def _verify_path(prefix, name):
+    """Dotted path of name below prefix, a (prefix, name) chain from verify"""
+    parts = [] if name is None else [name]
+    while prefix is not None:
+        prefix, name = prefix
+        parts.append(name)
+    return ".".join(reversed(parts))
+
+
+class _BFVerifyState:
+    """Bookkeeping shared by one BFContainer.verify walk
+
+    Paths are passed down the walk as (prefix, name) pairs and only joined
+    when a failure is recorded.
+    """
+
+    def __init__(self, buf, spans):
+        self.buf = buf
+        self.errors = []
+        # id(node) -> (start, end) for nodes referenced by a *Ref field
+        self.spans = spans
+        # (ref, prefix, name, offset, value) read from the buffer, checked at
+        # the end
+        self.refs = []
+
+    def fail(self, prefix, name, offset, reason):
+        self.errors.append(BFVerifyError(_verify_path(prefix, name), offset, reason))
+
+    def truncated(self, prefix, name, offset, width, end):
+        self.fail(
+            prefix,
+            name,
+            offset,
+            f"truncated: needs {width} bytes, {max(end - offset, 0)} available",
+        )
+
+
 class BFBasicDataType(abc.ABC):
     """BFBasicDataType
 
     Abstract base class for all data types
     """
 
+    # Set by BFContainer.add, changes are reported up through it
+    _parent = None
+
     def __init__(self):
         pass
 
@@ -47,6 +169,61 @@ class BFBasicDataType(abc.ABC):
     def length(self):
         pass
 
+    def _packed_length(self):
+        """Packed size in bytes, for use inside the package
+
+        Containers answer attribute lookups with their children first, so a
+        field named "length" hides the property but never this method.
+        """
+        return self.length
+
+    def _has_refs(self):
+        """True if a BFLengthRef or BFCallableRef is this node or below it"""
+        return False
+
+    def _invalidate(self, child=None):  # pylint: disable=unused-argument
+        """Called when this node changes, drops hashes cached above it"""
+        if self._parent is not None:
+            self._parent._invalidate(self)
+
+    def _node_key(self):
+        """Type and layout of this node, without its value or children"""
+        return (type(self),)
+
+    def _content_key(self):
+        return self.value
+
+    @property
+    def structure_hash(self):
+        """Hash of the layout of this node, ignoring values"""
+        return hash(self._node_key())
+
+    def __hash__(self):
+        return hash((self._node_key(), self._content_key()))
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(self) is not type(other):
+            return NotImplemented
+        return (
+            self._node_key() == other._node_key()
+            and self._content_key() == other._content_key()
+        )
+
+    def _verify(self, offset, end, prefix, name, state):
+        """Check this node against state.buf[offset:end]
+
+        Returns the offset just past this node, or -1 if the buffer ran out.
+        """
+        stop = offset + self.length
+        if stop > end:
+            state.truncated(prefix, name, offset, self.length, end)
+            return -1
+        if state.spans and id(self) in state.spans:
+            state.spans[id(self)] = (offset, stop)
+        return stop
+
 
 class BFUInt8(BFBasicDataType):
     """Unsigned int 8-bit"""
@@ -70,10 +247,15 @@ class BFUInt8(BFBasicDataType):
             self._value = ord(val)
         else:
             raise BFTypeException
+        if self._parent is not None:
+            self._invalidate()
 
     def pack(self):
         return struct.pack(self._fmt, self._value)
 
+    def _unpack_from(self, buf, offset):
+        return struct.unpack_from(self._fmt, buf, offset)[0]
+
     @property
     def length(self):
         return self._width
@@ -122,10 +304,18 @@ class BFUInt16(BFBasicDataType):
             if len(val) > 2:
                 raise BFRangeException
             self._value = struct.unpack("@" + self._fmt, val)[0]
+        if self._parent is not None:
+            self._invalidate()
 
     def pack(self):
         return struct.pack(self._endian + self._fmt, self.value)
 
+    def _unpack_from(self, buf, offset):
+        return struct.unpack_from(self._endian + self._fmt, buf, offset)[0]
+
+    def _node_key(self):
+        return (type(self), self._endian)
+
     @property
     def length(self):
         return self._width
@@ -174,10 +364,18 @@ class BFUInt32(BFBasicDataType):
             if len(val) > 4:
                 raise BFRangeException
             self._value = struct.unpack("@" + self._fmt, val)[0]
+        if self._parent is not None:
+            self._invalidate()
 
     def pack(self):
         return struct.pack(self._endian + self._fmt, self.value)
 
+    def _unpack_from(self, buf, offset):
+        return struct.unpack_from(self._endian + self._fmt, buf, offset)[0]
+
+    def _node_key(self):
+        return (type(self), self._endian)
+
     @property
     def length(self):
         return self._width
@@ -205,11 +403,10 @@ class BFBuffer(BFBasicDataType):
 
     def __init__(self, value=b""):
         self._value = value
-        self._width = len(self._value)
 
     @property
     def length(self):
-        return self._width
+        return len(self._value)
 
     def pack(self):
         return self.value
@@ -224,6 +421,18 @@ class BFBuffer(BFBasicDataType):
             self._value = val
         else:
             raise BFTypeException("BFBuffer must be type: bytes")
+        if self._parent is not None:
+            self._invalidate()
+
+    def _verify(self, offset, end, prefix, name, state):
+        # An empty template buffer is a variable sized payload that takes
+        # the rest of the enclosing length counted region
+        if not self.length:
+            stop = end
+            if state.spans and id(self) in state.spans:
+                state.spans[id(self)] = (offset, stop)
+            return stop
+        return super()._verify(offset, end, prefix, name, state)
 
     def pretty_print(self, indent=0):
         short_val = str(binascii.hexlify(self.pack()))
@@ -232,6 +441,277 @@ class BFBuffer(BFBasicDataType):
         return " " * indent + "|- " + f"Buffer {short_val}"
 
 
+def _typecode(codes, size):
+    """First array typecode in codes with the given item size"""
+    for code in codes:
+        if array.array(code).itemsize == size:
+            return code
+    raise BFTypeException(f"No array type of {size} bytes on this platform")
+
+
+class BFArray(BFBasicDataType):
+    """Homogeneous array of primitives backed by array.array
+
+    Args:
+        elem: BFUInt8, BFSInt8, BFUInt16, BFSInt16, BFUInt32 or BFSInt32, or
+            an array typecode such as "Q", "q", "f" or "d" for 64-bit and
+            float elements
+        value: iterable of initial elements
+        endian: BFEndian of each element
+        count_field: optional BFUInt* packed before the elements holding the
+            number of elements. Wrap the array in a BFLength instead for a
+            byte length prefix.
+
+    value returns a copy of the elements, change them in place with item
+    assignment, append or extend so that trees holding the array see it.
+    """
+
+    _TYPECODES = {
+        "BFUInt8": "B",
+        "BFSInt8": "b",
+        "BFUInt16": "H",
+        "BFSInt16": "h",
+        "BFUInt32": _typecode("IL", 4),
+        "BFSInt32": _typecode("il", 4),
+    }
+
+    def __init__(self, elem, value=(), endian=BFEndian.LITTLE, count_field=None):
+        if isinstance(elem, str):
+            self._typecode = elem
+        elif isinstance(elem, type) and elem.__name__ in self._TYPECODES:
+            self._typecode = self._TYPECODES[elem.__name__]
+        else:
+            raise BFTypeException(f"Unsupported BFArray element type: {elem}")
+        if endian == BFEndian.LITTLE:
+            self._swap = sys.byteorder != "little"
+        elif endian == BFEndian.BIG:
+            self._swap = sys.byteorder != "big"
+        else:
+            raise BFEndianException
+        self._count_field = count_field
+        self.value = value
+
+    @property
+    def value(self):
+        return array.array(self._typecode, self._value)
+
+    @value.setter
+    def value(self, val):
+        try:
+            if isinstance(val, (bytes, bytearray, memoryview)):
+                arr = array.array(self._typecode)
+                arr.frombytes(val)
+                if self._swap:
+                    arr.byteswap()
+            else:
+                arr = array.array(self._typecode, val)
+        except (OverflowError, ValueError) as exc:
+            raise BFRangeException(str(exc)) from exc
+        self._value = arr
+        if self._parent is not None:
+            self._invalidate()
+
+    def pack(self):
+        arr = self._value
+        if self._swap:
+            arr = array.array(self._typecode, arr)
+            arr.byteswap()
+        data = arr.tobytes()
+        if self._count_field is not None:
+            self._count_field.value = len(arr)
+            return self._count_field.pack() + data
+        return data
+
+    @property
+    def length(self):
+        length = len(self._value) * self._value.itemsize
+        if self._count_field is not None:
+            length += self._count_field.length
+        return length
+
+    def __len__(self):
+        return len(self._value)
+
+    def __iter__(self):
+        return iter(self._value)
+
+    def __getitem__(self, index):
+        return self._value[index]
+
+    def __setitem__(self, index, val):
+        try:
+            self._value[index] = val
+        except OverflowError as exc:
+            raise BFRangeException(str(exc)) from exc
+        if self._parent is not None:
+            self._invalidate()
+
+    def append(self, val):
+        """Add one element at the end"""
+        self.extend((val,))
+
+    def extend(self, values):
+        """Add elements at the end"""
+        try:
+            self._value.extend(array.array(self._typecode, values))
+        except (OverflowError, ValueError) as exc:
+            raise BFRangeException(str(exc)) from exc
+        if self._parent is not None:
+            self._invalidate()
+
+    def _node_key(self):
+        count_key = None
+        if self._count_field is not None:
+            count_key = self._count_field._node_key()
+        return (type(self), self._typecode, self._swap, count_key)
+
+    def _content_key(self):
+        return self._value.tobytes()
+
+    def _verify(self, offset, end, prefix, name, state):
+        itemsize = self._value.itemsize
+        if self._count_field is not None:
+            field = self._count_field
+            stop = offset + field.length
+            if stop > end:
+                state.truncated(prefix, name, offset, field.length, end)
+                return -1
+            stop += field._unpack_from(state.buf, offset) * itemsize
+            if stop > end:
+                state.truncated(prefix, name, offset, stop - offset, end)
+                return -1
+        elif not self._value:
+            # Like BFBuffer, an empty template takes the rest of its region
+            stop = end
+            if (stop - offset) % itemsize:
+                state.fail(
+                    prefix,
+                    name,
+                    offset,
+                    f"{stop - offset} bytes is not a whole number of "
+                    f"{itemsize} byte elements",
+                )
+        else:
+            return super()._verify(offset, end, prefix, name, state)
+        if state.spans and id(self) in state.spans:
+            state.spans[id(self)] = (offset, stop)
+        return stop
+
+    def __str__(self):
+        return self.pretty_print()
+
+    def pretty_print(self, indent=0):
+        shown = " ".join(str(val) for val in self._value[:8])
+        if len(self._value) > 8:
+            shown += " ..."
+        return (
+            " " * indent
+            + "|- "
+            + f"Array {self._typecode}[{len(self._value)}] {shown}".rstrip()
+        )
+
+
+class BFBitField(BFBasicDataType):
+    """Named sub-byte fields packed into one BFUInt8/16/32 word
+
+    Args:
+        word: BFUInt8, BFUInt16 or BFUInt32 giving the width and endianness
+        fields: sequence of (name, bits), most significant bits first. Any
+            bits left over at the bottom of the word are padding.
+
+    The fields share a single integer, so pack() is one struct call on the
+    word and setting value updates every field at once.
+    """
+
+    def __init__(self, word, fields):
+        if type(word) not in (BFUInt8, BFUInt16, BFUInt32):
+            raise BFTypeException("BFBitField word must be BFUInt8, 16 or 32")
+        self._word = word
+        word._parent = self
+        self._fields = OrderedDict()
+        shift = 8 * word.length
+        for name, bits in fields:
+            # Sub-fields are read through __getattr__, so they must not
+            # shadow anything of the class
+            if name.startswith("_") or hasattr(BFBitField, name):
+                raise BFTypeException(f"Invalid bit field name: {name}")
+            shift -= bits
+            if bits <= 0 or shift < 0:
+                raise BFRangeException(
+                    f"Bit fields do not fit in a {word.length} byte word"
+                )
+            self._fields[name] = (shift, (1 << bits) - 1)
+
+    def __getattr__(self, name):
+        # Only called when normal lookup fails, so sub-fields cost nothing extra
+        if not name.startswith("_") and name in self._fields:
+            shift, mask = self._fields[name]
+            return (self._word._value >> shift) & mask
+        raise AttributeError(name)
+
+    def __setattr__(self, name, val):
+        if not name.startswith("_") and name in self._fields:
+            shift, mask = self._fields[name]
+            word = self._word
+            word.value = (word._value & ~(mask << shift)) | ((val & mask) << shift)
+        else:
+            super().__setattr__(name, val)
+
+    def update(self, **values):
+        """Set several fields with a single write to the word"""
+        word = self._word._value
+        for name, val in values.items():
+            shift, mask = self._fields[name]
+            word = (word & ~(mask << shift)) | ((val & mask) << shift)
+        self._word.value = word
+        return self
+
+    @property
+    def fields(self):
+        """OrderedDict of field name to value"""
+        word = self._word._value
+        return OrderedDict(
+            (name, (word >> shift) & mask)
+            for name, (shift, mask) in self._fields.items()
+        )
+
+    @property
+    def value(self):
+        return self._word.value
+
+    @value.setter
+    def value(self, val):
+        if isinstance(val, (bytes, bytearray)):
+            # Bytes are the packed word, in the word's byte order
+            if len(val) != self._word.length:
+                raise BFRangeException(
+                    f"Expected {self._word.length} bytes, got {len(val)}"
+                )
+            val = self._word._unpack_from(val, 0)
+        self._word.value = val
+
+    def pack(self):
+        return self._word.pack()
+
+    def _unpack_from(self, buf, offset):
+        return self._word._unpack_from(buf, offset)
+
+    def _node_key(self):
+        return (type(self), self._word._node_key(), tuple(self._fields.items()))
+
+    @property
+    def length(self):
+        return self._word.length
+
+    def __str__(self):
+        return self.pretty_print()
+
+    def pretty_print(self, indent=0):
+        fields = ", ".join(f"{name}={val:#x}" for name, val in self.fields.items())
+        width = 2 * self.length
+        return " " * indent + "|- " + f"Bits 0x{self.value:0{width}X} ({fields})"
+
+
 # is a container a basic data type or its own thing?
 class BFContainer(BFBasicDataType):
     """docstring for BFContainer"""
@@ -240,6 +720,21 @@ class BFContainer(BFBasicDataType):
         self._children = OrderedDict()
         self._name = None
         self._parent = None
+        # Cached by __hash__, structure_hash, length, _layout and _has_refs,
+        # _cached is set while any of them is and all are cleared together
+        # by _invalidate
+        self._cached = False
+        self._hash = None
+        self._structure_hash = None
+        self._size = None
+        self._refs = None
+        self._offsets = None
+        # id(child) -> (name, hash term) in the order of the children and
+        # the sum of the terms, kept by __hash__ across changes, _dirty holds
+        # children changed since
+        self._terms = None
+        self._dirty = None
+        self._hash_sum = 0
 
     @property
     def name(self):
@@ -261,42 +756,203 @@ class BFContainer(BFBasicDataType):
         root = name
         obj._parent = self
         sub_container = None
-        logging.debug(name)
         if "." in root:
             root, sub_container = root.split(".", 1)
-        logging.debug("%s : %s", root, sub_container)
-        logging.debug("Adding %s to %s (sub: %s)", type(obj), root, sub_container)
+        if _TRACE:
+            _LOGGER.debug("Adding %s to %s (sub: %s)", type(obj), root, sub_container)
         if root is not None and sub_container is None and isinstance(obj, BFContainer):
-            logging.debug("SETTING NAME!!! %s", sub_container)
             obj.name = root
-        if root in iter(self._children) and sub_container is not None:
+        if root in self._children and sub_container is not None:
             # Recurse
-            logging.debug("%s in children for this container", root)
             self._children[root].add(sub_container, obj)
         else:
-            logging.debug("New child, Setting %s to %s", root, obj)
+            if _TRACE:
+                _LOGGER.debug("New child %s in %s", root, self._name)
+            if self._terms is not None:
+                self._replace_term(root, obj)
             self._children[root] = obj
+            if self._cached:
+                self._invalidate()
 
         return self
 
     def __getattribute__(self, name):
-        if name != "_children" and name in self._children.keys():
-            return self._children[name]
+        children = object.__getattribute__(self, "_children")
+        if name != "_children" and name in children:
+            return children[name]
 
-        return super().__getattribute__(name)
+        return object.__getattribute__(self, name)
 
     def __setattr__(self, name, obj):
         if isinstance(obj, BFBasicDataType) and not name.startswith(
             "_"
         ):  # Or whatever a container is?
-            logging.debug("SETTER: %s", name)
+            if _TRACE:
+                _LOGGER.debug("SETTER: %s", name)
             self.add(name, obj)
         else:
             super().__setattr__(name, obj)
 
     @property
     def length(self):
-        return len(repr(self))
+        """Packed size in bytes, cached until the tree changes"""
+        return self._packed_length()
+
+    def _packed_length(self):
+        if self._size is None:
+            self._size = sum(
+                child._packed_length() for child in self._children.values()
+            )
+            self._cached = True
+        return self._size
+
+    def _invalidate(self, child=None):
+        node = self
+        while node is not None:
+            if child is not None and node._terms is not None:
+                node._dirty[id(child)] = child
+            # Containers only cache from values their child containers cache
+            # too, so once a node with nothing cached is reached everything
+            # above was already cleared and told about it
+            if not node._cached:
+                break
+            node._cached = False
+            node._hash = None
+            node._structure_hash = None
+            node._size = None
+            node._refs = None
+            node._offsets = None
+            child = node
+            node = node._parent
+
+    def _layout(self):
+        """Offset of every node in this tree from its start, by id
+
+        Computed in one pass over the cached sizes and kept until the tree
+        changes, so any number of BFOffsetRef lookups cost one walk.
+        """
+        if self._offsets is None:
+            offsets = {}
+            self._lay_out(0, offsets)
+            self._offsets = offsets
+            self._cached = True
+        return self._offsets
+
+    def _lay_out(self, offset, offsets):
+        offsets[id(self)] = offset
+        for child in self._children.values():
+            if isinstance(child, BFContainer):
+                child._lay_out(offset, offsets)
+            else:
+                offsets[id(child)] = offset
+            offset += child._packed_length()
+
+    def _has_refs(self):
+        if self._refs is None:
+            # Every child is visited, not just up to the first ref, so that
+            # _invalidate reaches this node from any of them
+            refs = False
+            for child in self._children.values():
+                if child._has_refs():
+                    refs = True
+            self._refs = refs
+            self._cached = True
+        return self._refs
+
+    @property
+    def structure_hash(self):
+        """Hash of the layout of this tree, ignoring values
+
+        Cached and kept up to date by add.
+        """
+        if self._structure_hash is None:
+            self._structure_hash = hash(
+                (
+                    self._node_key(),
+                    tuple(
+                        (name, child.structure_hash)
+                        for name, child in self._children.items()
+                    ),
+                )
+            )
+            self._cached = True
+        return self._structure_hash
+
+    def __hash__(self):
+        """Hash of the layout and values of this tree
+
+        Cached and kept up to date by add and the value setters, so repeated
+        hashing and comparison of unchanged trees does not walk or pack them.
+        Children are combined as a sum of one term per name and child, so
+        after a change only the changed nodes on the path to the root are
+        hashed again. Changing a tree while it is in a set or dict loses it
+        there.
+        """
+        if self._hash is None:
+            if self._terms is None:
+                self._hash_terms()
+            elif self._dirty:
+                self._update_terms()
+            self._hash = hash((self._node_key(), self._hash_sum))
+            self._cached = True
+        return self._hash
+
+    def _hash_terms(self):
+        terms = {}
+        total = 0
+        for name, child in self._children.items():
+            term = hash((name, hash(child)))
+            terms[id(child)] = (name, term)
+            total += term
+        self._terms = terms
+        self._dirty = {}
+        self._hash_sum = total & _HASH_MASK
+
+    def _update_terms(self):
+        terms = self._terms
+        total = self._hash_sum
+        for key, child in self._dirty.items():
+            # Children replaced by add still point here when they change
+            entry = terms.get(key)
+            if entry is None:
+                continue
+            name, old = entry
+            term = hash((name, hash(child)))
+            terms[key] = (name, term)
+            total += term - old
+        self._dirty = {}
+        self._hash_sum = total & _HASH_MASK
+
+    def _replace_term(self, name, obj):
+        """Keep the hash terms in step with add putting obj at name"""
+        if name in self._children:
+            # Replacing keeps the child's place, which the terms cannot, so
+            # they are rebuilt on the next hash
+            self._terms = None
+            self._dirty = None
+            self._hash_sum = 0
+            return
+        # Counted as a change from a zero term
+        self._terms[id(obj)] = (name, 0)
+        self._dirty[id(obj)] = obj
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(self) is not type(other):
+            return NotImplemented
+        if hash(self) != hash(other) or self._node_key() != other._node_key():
+            return False
+        children = self._children
+        other_children = other._children
+        if len(children) != len(other_children):
+            return False
+        for (name, child), (other_name, other_child) in zip(
+            children.items(), other_children.items()
+        ):
+            if name != other_name or child != other_child:
+                return False
+        return True
 
     # Does value make sense? Does this show we need another basic class type?
     # @property
@@ -308,15 +964,121 @@ class BFContainer(BFBasicDataType):
         return list(iter(self._children.values()))[:]
 
     def pack(self):
-        data = b""
-        children = self._get_children()
-        while len(children):
-            child = children.pop()
-            if isinstance(child, BFBasicDataType):
-                data = child.pack() + data
-            else:
-                data = repr(child) + data
-        return data
+        profiler = _PROFILER.get()
+        if profiler is None:
+            return b"".join([child.pack() for child in self._children.values()])
+        if _PROFILING.get() is not profiler:
+            return profiler._pack(self)
+        return b"".join([profiler._pack(child) for child in self._children.values()])
+
+    def diff(self, other):
+        """Compare this tree with another of the same schema
+
+        Walks both trees together, skipping subtrees whose cached hashes
+        match, and reports each changed field with its byte range in both
+        packed buffers. Fields whose layout differs are reported whole.
+
+        Args:
+            other: BFContainer built from the same schema
+
+        Returns:
+            list of BFDiff in packed order
+        """
+        return [entry for entry, _, _ in self._diff_parts(other)]
+
+    def patch(self, other):
+        """Minimal byte range edits turning self.pack() into other.pack()
+
+        Returns:
+            list of BFPatch, apply with BFContainer.apply_patch
+        """
+        ops = []
+        for entry, part, other_part in self._diff_parts(other):
+            data = part.pack()
+            other_data = other_part.pack()
+            start, end = 0, len(data)
+            if end == len(other_data):
+                # Trim bytes that did not change
+                while start < end and data[start] == other_data[start]:
+                    start += 1
+                while end > start and data[end - 1] == other_data[end - 1]:
+                    end -= 1
+                if start == end:
+                    continue
+                other_data = other_data[start:end]
+            op = BFPatch(entry.offset + start, end - start, other_data)
+            if ops and ops[-1].offset + ops[-1].length == op.offset:
+                last = ops.pop()
+                op = BFPatch(last.offset, last.length + op.length, last.data + op.data)
+            ops.append(op)
+        return ops
+
+    @staticmethod
+    def apply_patch(data, patch):
+        """Apply a list of BFPatch from BFContainer.patch to packed bytes"""
+        out = bytearray(data)
+        for op in sorted(patch, reverse=True):
+            out[op.offset : op.offset + op.length] = op.data
+        return bytes(out)
+
+    def _diff_parts(self, other):
+        walk = _BFDiffWalk()
+        walk.walk(self, other, "", 0, 0)
+        return walk.parts
+
+    def verify(self, buffer):
+        """Check that buffer matches this template without building a tree
+
+        Walks the bytes once, checking that nothing is truncated, that
+        BFLength prefixes agree with the size of their body and that
+        BFLengthRef/BFCallableRef fields hold the value pack() would write.
+
+        Args:
+            buffer: bytes-like object to check
+
+        Returns:
+            list of BFVerifyError, empty if the buffer is valid
+        """
+        refs = []
+        self._collect_refs(refs)
+        spans = {id(node): None for ref in refs for node in ref._verify_targets()}
+        state = _BFVerifyState(buffer, spans)
+
+        end = len(buffer)
+        offset = self._verify(0, end, None, None, state)
+        if 0 <= offset < end:
+            state.fail(None, None, offset, f"{end - offset} trailing bytes")
+
+        for ref, prefix, name, field_offset, value in state.refs:
+            expected = ref._expected(state)
+            if expected is None:
+                continue
+            if value != expected:
+                state.fail(
+                    prefix,
+                    name,
+                    field_offset,
+                    f"expected 0x{expected:0x}, found 0x{value:0x}",
+                )
+        return state.errors
+
+    def _collect_refs(self, refs):
+        for child in self._children.values():
+            if isinstance(child, (BFLengthRef, BFCallableRef)):
+                refs.append(child)
+            elif isinstance(child, BFContainer):
+                child._collect_refs(refs)
+
+    def _verify(self, offset, end, prefix, name, state):
+        start = offset
+        path = prefix if name is None else (prefix, name)
+        for child_name, child in self._children.items():
+            offset = child._verify(offset, end, path, child_name, state)
+            if offset < 0:
+                return offset
+        if state.spans and id(self) in state.spans:
+            state.spans[id(self)] = (start, offset)
+        return offset
 
     # def __str__( self ):
     #    return binascii.hexlify( repr( self ) )
@@ -327,7 +1089,8 @@ class BFContainer(BFBasicDataType):
     def pretty_print(self, indent=0):
         ret = " " * indent + f"+{self.name}\n"
         for child in self._children:
-            logging.debug("current child: %s (%s)", child, indent)
+            if _TRACE:
+                _LOGGER.debug("current child: %s (%s)", child, indent)
             if isinstance(self._children[child], BFContainer):
                 ret += "|" + self._children[child].pretty_print(indent + 1)
             else:
@@ -347,12 +1110,15 @@ class BFLength(BFContainer):
         super().__init__()
         self._field = field
         self._children["_data"] = container
+        container._parent = self
 
     def __getattribute__(self, name):
-        if name != "_children" and name in self._children["_data"]._children.keys():
-            return self._children["_data"]._children[name]
+        if name != "_children":
+            data = object.__getattribute__(self, "_children")["_data"]
+            if isinstance(data, BFContainer) and name in data._children:
+                return data._children[name]
 
-        return super(BFContainer, self).__getattribute__(name)
+        return object.__getattribute__(self, name)
 
     def __setattr__(self, name, obj):
         if isinstance(obj, BFBasicDataType) and not name.startswith("_"):
@@ -360,30 +1126,65 @@ class BFLength(BFContainer):
         else:
             super(BFContainer, self).__setattr__(name, obj)
 
-    def pack(self):
-        data = b""
-        children = self._get_children()
-        while len(children):
-            child = children.pop()
-            if isinstance(child, BFBasicDataType):
-                data = child.pack() + data
-            else:
-                data = repr(child) + data
+    def _node_key(self):
+        return (type(self), self._field._node_key())
+
+    def _packed_length(self):
+        if self._size is None:
+            self._size = self._field.length + self._children["_data"]._packed_length()
+            self._cached = True
+        return self._size
 
+    def _lay_out(self, offset, offsets):
+        offsets[id(self)] = offset
+        body = self._children["_data"]
+        if isinstance(body, BFContainer):
+            body._lay_out(offset + self._field.length, offsets)
+        else:
+            offsets[id(body)] = offset + self._field.length
+
+    def pack(self):
+        profiler = _PROFILER.get()
+        if profiler is not None and _PROFILING.get() is not profiler:
+            return profiler._pack(self)
+        data = self._children["_data"].pack()
         self._field.value = len(data)
         return self._field.pack() + data
 
+    def _verify(self, offset, end, prefix, name, state):
+        field = self._field
+        width = field.length
+        start = offset + width
+        if start > end:
+            state.truncated(prefix, name, offset, width, end)
+            return -1
+        count = field._unpack_from(state.buf, offset)
+        stop = start + count
+        if stop > end:
+            state.fail(
+                prefix,
+                name,
+                offset,
+                f"length 0x{count:0x} runs past end of buffer by {stop - end} bytes",
+            )
+            return -1
+
+        # The body shares this node's path, "_data" is an implementation detail
+        body_end = self._children["_data"]._verify(start, stop, prefix, name, state)
+        if 0 <= body_end != stop:
+            state.fail(
+                prefix,
+                name,
+                offset,
+                f"length 0x{count:0x} but body is 0x{body_end - start:0x} bytes",
+            )
+        if state.spans and id(self) in state.spans:
+            state.spans[id(self)] = (offset, stop)
+        return stop
+
     @property
     def value(self):
-        data = b""
-        children = self._get_children()
-        while len(children):
-            child = children.pop()
-            if isinstance(child, BFBasicDataType):
-                data = child.pack() + data
-            else:
-                data = repr(child) + data
-        self._field.value = len(data)
+        self._field.value = len(_pack_unprofiled(self._children["_data"]))
         return self._field.value
 
     def __str__(self):
@@ -391,8 +1192,11 @@ class BFLength(BFContainer):
 
     def pretty_print(self, indent=0):
         ret = " " * indent + f"+{self.name} length: 0x{self.value:0x}\n"
+        if not isinstance(self._children["_data"], BFContainer):
+            return ret + "|" + self._children["_data"].pretty_print(indent + 1) + "\n"
         for child in self._children["_data"]._children:
-            logging.debug("current child: %s (%s)", child, indent)
+            if _TRACE:
+                _LOGGER.debug("current child: %s (%s)", child, indent)
             if isinstance(self._children["_data"]._children[child], BFContainer):
                 ret += "|" + self._children["_data"]._children[child].pretty_print(
                     indent + 1
@@ -416,10 +1220,22 @@ class BFLengthRef(BFContainer):
         self._ref = container_ref
         # self._children["_data"] = container_ref
 
+    def _node_key(self):
+        return (type(self), self._field._node_key(), self._ref)
+
+    def _packed_length(self):
+        return self._field.length
+
+    def _has_refs(self):
+        return True
+
     def _get_root(self, obj) -> BFBasicDataType:
-        if obj.parent is None:
-            return obj
-        return self._get_root(obj.parent)
+        # References inside a BFLength are relative to its body
+        parent = obj._parent
+        while parent is not None and not isinstance(parent, BFLength):
+            obj = parent
+            parent = obj._parent
+        return obj
 
     def _get_children(self):
         """Returns the length someones children"""
@@ -434,15 +1250,38 @@ class BFLengthRef(BFContainer):
 
     def pack(self):
         children = self._get_children()
-        self._field.value = len(children.pack())
+        profiler = _PROFILER.get()
+        data = children.pack() if profiler is None else profiler._pack(children)
+        self._field.value = len(data)
         return self._field.pack()
 
     @property
     def value(self):
-        children = self._get_children()
-        self._field.value = len(children.pack())
+        data = _pack_unprofiled(self._get_children())
+        self._field.value = len(data)
         return self._field.value
 
+    def _verify(self, offset, end, prefix, name, state):
+        field = self._field
+        stop = offset + field.length
+        if stop > end:
+            state.truncated(prefix, name, offset, field.length, end)
+            return -1
+        state.refs.append(
+            (self, prefix, name, offset, field._unpack_from(state.buf, offset))
+        )
+        return stop
+
+    def _verify_targets(self):
+        """Nodes whose position in the buffer _expected needs"""
+        return (self._get_children(),)
+
+    def _expected(self, state):
+        span = state.spans[id(self._get_children())]
+        if span is None:
+            return None
+        return (span[1] - span[0]) & ((1 << (8 * self._field.length)) - 1)
+
     def __str__(self):
         return self.pretty_print()
 
@@ -461,10 +1300,22 @@ class BFCallableRef(BFContainer):
         self._func = func
         self._ref = container_ref
 
+    def _node_key(self):
+        return (type(self), self._field._node_key(), self._func, self._ref)
+
+    def _packed_length(self):
+        return self._field.length
+
+    def _has_refs(self):
+        return True
+
     def _get_root(self, obj) -> BFBasicDataType:
-        if obj.parent is None:
-            return obj
-        return self._get_root(obj.parent)
+        # References inside a BFLength are relative to its body
+        parent = obj._parent
+        while parent is not None and not isinstance(parent, BFLength):
+            obj = parent
+            parent = obj._parent
+        return obj
 
     def _get_children(self):
         """Returns children of the branch referred to"""
@@ -479,15 +1330,38 @@ class BFCallableRef(BFContainer):
 
     def pack(self):
         children = self._get_children()
-        self._field.value = self._func(children.pack())
+        profiler = _PROFILER.get()
+        data = children.pack() if profiler is None else profiler._pack(children)
+        self._field.value = self._func(data)
         return self._field.pack()
 
     @property
     def value(self):
-        children = self._get_children()
-        self._field.value = self._func(children.pack())
+        data = _pack_unprofiled(self._get_children())
+        self._field.value = self._func(data)
         return self._field.value
 
+    def _verify(self, offset, end, prefix, name, state):
+        field = self._field
+        stop = offset + field.length
+        if stop > end:
+            state.truncated(prefix, name, offset, field.length, end)
+            return -1
+        state.refs.append(
+            (self, prefix, name, offset, field._unpack_from(state.buf, offset))
+        )
+        return stop
+
+    def _verify_targets(self):
+        return (self._get_children(),)
+
+    def _expected(self, state):
+        span = state.spans[id(self._get_children())]
+        if span is None:
+            return None
+        mask = (1 << (8 * self._field.length)) - 1
+        return self._func(bytes(state.buf[span[0] : span[1]])) & mask
+
     def __str__(self):
         return self.pretty_print()
 
@@ -497,6 +1371,283 @@ class BFCallableRef(BFContainer):
         return ret
 
 
+class BFOffsetRef(BFLengthRef):
+    """Byte offset of another part of the tree
+
+    Args:
+        field: BFUInt* holding the offset
+        container_ref: dotted path of the node whose offset is stored
+        base_ref: optional dotted path the offset is measured from, defaults
+            to the start of the tree the path is resolved in
+
+    Offsets for every node come from one layout pass over cached sizes that
+    is shared by all BFOffsetRef fields of the tree, so references may point
+    forwards and packing stays linear in the number of fields.
+    """
+
+    def __init__(self, field, container_ref, base_ref=None):
+        super().__init__(field, container_ref)
+        self._base_ref = base_ref
+
+    def _node_key(self):
+        return (type(self), self._field._node_key(), self._ref, self._base_ref)
+
+    @staticmethod
+    def _resolve(root, path):
+        obj = root
+        for part in path.split("."):
+            obj = obj._children[part]
+        return obj
+
+    def _get_base(self):
+        root = self._get_root(self)
+        if self._base_ref is None:
+            return root
+        return self._resolve(root, self._base_ref)
+
+    def _offset(self):
+        root = self._get_root(self)
+        layout = root._layout()
+        offset = layout[id(self._resolve(root, self._ref))]
+        if self._base_ref is not None:
+            offset -= layout[id(self._resolve(root, self._base_ref))]
+        return offset
+
+    def pack(self):
+        self._field.value = self._offset()
+        return self._field.pack()
+
+    @property
+    def value(self):
+        self._field.value = self._offset()
+        return self._field.value
+
+    def _verify_targets(self):
+        return (self._get_children(), self._get_base())
+
+    def _expected(self, state):
+        span = state.spans[id(self._get_children())]
+        base = state.spans[id(self._get_base())]
+        if span is None or base is None:
+            return None
+        return (span[0] - base[0]) & ((1 << (8 * self._field.length)) - 1)
+
+    def pretty_print(self, indent=0):
+        ret = " " * indent + f"+{self.name} offset: 0x{self.value:0x}\n"
+
+        return ret
+
+
+class _BFDiffWalk:
+    """Walks two trees of the same schema together for BFContainer.diff"""
+
+    def __init__(self):
+        # (BFDiff, part, other_part) where part and other_part pack to the
+        # changed bytes of each tree
+        self.parts = []
+
+    def changed(self, path, part, other_part, offset, other_offset):
+        entry = BFDiff(
+            path,
+            offset,
+            part._packed_length(),
+            other_offset,
+            other_part._packed_length(),
+        )
+        self.parts.append((entry, part, other_part))
+
+    def walk(self, node, other, path, offset, other_offset):
+        if type(node) is not type(other) or node._node_key() != other._node_key():
+            self.changed(path, node, other, offset, other_offset)
+        elif isinstance(node, (BFLengthRef, BFCallableRef)):
+            if self._ref_changed(node, other):
+                self.changed(path, node, other, offset, other_offset)
+        elif isinstance(node, BFLength):
+            self._walk_length(node, other, path, offset, other_offset)
+        elif isinstance(node, BFContainer):
+            self._walk_children(node, other, path, offset, other_offset)
+        elif node._content_key() != other._content_key():
+            self.changed(path, node, other, offset, other_offset)
+
+    @staticmethod
+    def _ref_changed(node, other):
+        if isinstance(node, BFOffsetRef):
+            return node.value != other.value
+        # Computed fields can change without their own hash changing
+        target = node._get_children()
+        other_target = other._get_children()
+        if hash(target) == hash(other_target):
+            return False
+        if isinstance(node, BFLengthRef):
+            mask = (1 << (8 * node._field.length)) - 1
+            return (target._packed_length() ^ other_target._packed_length()) & mask != 0
+        return node.value != other.value
+
+    def _walk_length(self, node, other, path, offset, other_offset):
+        same = hash(node) == hash(other)
+        if same and not node._has_refs():
+            return
+        body = node._children["_data"]
+        other_body = other._children["_data"]
+        if not same:
+            node._field.value = body._packed_length()
+            other._field.value = other_body._packed_length()
+            if node._field.value != other._field.value:
+                self.changed(path, node._field, other._field, offset, other_offset)
+        width = node._field.length
+        self.walk(body, other_body, path, offset + width, other_offset + width)
+
+    def _walk_children(self, node, other, path, offset, other_offset):
+        # Hashing brings the per child terms of both containers up to date
+        if hash(node) == hash(other) and not node._has_refs():
+            return
+        # The terms are (name, hash term) in the order of the children, the
+        # children whose terms match are skipped
+        terms = list(node._terms.values())
+        other_terms = list(other._terms.values())
+        walked = list(compress(range(len(terms)), map(ne, terms, other_terms)))
+        if len(terms) != len(other_terms) or any(
+            terms[index][0] != other_terms[index][0] for index in walked
+        ):
+            self.changed(path, node, other, offset, other_offset)
+            return
+        values = list(node._children.values())
+        other_values = list(other._children.values())
+        if node._has_refs():
+            # Computed fields change without their hash following the target
+            walked = sorted(
+                set(walked).union(
+                    index for index, child in enumerate(values) if child._has_refs()
+                )
+            )
+        # Sizes are only summed up to the last child walked
+        done = 0
+        for index in walked:
+            offset += sum(child._packed_length() for child in values[done:index])
+            other_offset += sum(
+                child._packed_length() for child in other_values[done:index]
+            )
+            done = index
+            self.walk(
+                values[index],
+                other_values[index],
+                _join_path(path, terms[index][0]),
+                offset,
+                other_offset,
+            )
+
+
+class BFProfileStat:  # pylint: disable=too-few-public-methods
+    """Counters for one dotted path or node type in a BFProfiler"""
+
+    def __init__(self):
+        self.calls = 0
+        self.time = 0.0
+        self.bytes = 0
+
+    def __repr__(self):
+        return (
+            f"BFProfileStat(calls={self.calls}, time={self.time:.6f}, "
+            f"bytes={self.bytes})"
+        )
+
+
+class BFProfiler:
+    """Records per node pack() statistics while active
+
+    Use as a context manager around calls to BFContainer.pack:
+
+        with BFProfiler() as prof:
+            data.pack()
+        print(prof.report())
+
+    Every pack() of a node below the top-level container is counted under
+    its dotted path and its type, with inclusive time and bytes produced.
+    Subtrees packed again by BFLengthRef/BFCallableRef show up as extra
+    calls on the same path, reading their value outside pack() is not
+    counted. The profiler is held in a context variable, so it only sees
+    packs in the thread or task that entered it and tasks created there.
+    When no profiler is active pack() only pays for one lookup of it.
+    """
+
+    def __init__(self):
+        self.paths = {}
+        self.types = {}
+        self.packs = 0
+        self._hooks = []
+        self._path_map = {}
+        self._token = None
+
+    def __enter__(self):
+        self._token = _PROFILER.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        _PROFILER.reset(self._token)
+        self._token = None
+
+    def add_hook(self, hook):
+        """Call hook(path, node, elapsed, nbytes) after every recorded pack"""
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def _map_paths(self, node, path):
+        self._path_map[id(node)] = path
+        if isinstance(node, BFContainer):
+            for name, child in node._children.items():
+                # A BFLength body shares the BFLength's path
+                self._map_paths(
+                    child, path if name == "_data" else _join_path(path, name)
+                )
+
+    def _pack(self, node):
+        token = None
+        if _PROFILING.get() is not self:
+            self.packs += 1
+            self._path_map = {}
+            self._map_paths(node, "")
+            token = _PROFILING.set(self)
+        start = time.perf_counter()
+        try:
+            data = node.pack()
+        finally:
+            if token is not None:
+                _PROFILING.reset(token)
+        elapsed = time.perf_counter() - start
+
+        path = self._path_map.get(id(node), type(node).__name__)
+        for stats, key in ((self.paths, path), (self.types, type(node).__name__)):
+            stat = stats.get(key)
+            if stat is None:
+                stat = stats[key] = BFProfileStat()
+            stat.calls += 1
+            stat.time += elapsed
+            stat.bytes += len(data)
+        for hook in self._hooks:
+            hook(path, node, elapsed, len(data))
+        return data
+
+    def report(self, limit=None):
+        """Returns a table of paths and types ordered by cumulative time"""
+        lines = []
+        for title, stats in (("path", self.paths), ("type", self.types)):
+            lines.append(
+                f"{title:40} {'calls':>10} {'per pack':>10} {'time (s)':>12} "
+                f"{'bytes':>12}"
+            )
+            ordered = sorted(stats.items(), key=lambda item: item[1].time, reverse=True)
+            for key, stat in ordered[:limit]:
+                lines.append(
+                    f"{key or '<root>':40} {stat.calls:10} "
+                    f"{stat.calls / max(self.packs, 1):10.1f} {stat.time:12.6f} "
+                    f"{stat.bytes:12}"
+                )
+            lines.append("")
+        return "\n".join(lines)
+
+
 def main():
     pass
 
@@ -0,0 +1,276 @@
+"""BitFactory schema cache
+
+Serializes templates to a compact JSON form holding structure, types,
+endianness, default values and reference paths, and rebuilds them without
+going through BFContainer.add. A one line JSON header holding the format
+version and the digest of the schema precedes it.
+"""
+
+import array
+import base64
+import hashlib
+import importlib
+import json
+import os
+import sys
+
+from .bitfactory import (
+    BFArray,
+    BFBitField,
+    BFBuffer,
+    BFCallableRef,
+    BFContainer,
+    BFEndian,
+    BFLength,
+    BFLengthRef,
+    BFOffsetRef,
+    BFSInt8,
+    BFSInt16,
+    BFSInt32,
+    BFUInt8,
+    BFUInt16,
+    BFUInt32,
+)
+from .exceptions import BFTypeException
+
+# Bump when the encoding changes, older cache files are then rebuilt
+FORMAT_VERSION = 2
+
+_BYTES = (BFUInt8, BFSInt8)
+_WORDS = (BFUInt16, BFSInt16, BFUInt32, BFSInt32)
+_OTHERS = (BFArray, BFBitField, BFBuffer, BFCallableRef, BFContainer, BFLength)
+_REFS = (BFLengthRef, BFOffsetRef)
+_TYPES = {cls.__name__: cls for cls in _BYTES + _WORDS + _OTHERS + _REFS}
+_ENDIAN = {"<": BFEndian.LITTLE, ">": BFEndian.BIG}
+
+
+def _func_name(func):
+    name = f"{func.__module__}:{func.__qualname__}"
+    if "<" in name:
+        raise BFTypeException(
+            f"BFCallableRef function {name} must be importable to be cached"
+        )
+    return name
+
+
+def _import_func(name):
+    try:
+        module, qualname = name.split(":")
+        obj = importlib.import_module(module)
+        for part in qualname.split("."):
+            obj = getattr(obj, part)
+    except (ImportError, AttributeError, ValueError) as exc:
+        raise BFTypeException(f"Cannot import cached function {name}") from exc
+    return obj
+
+
+def _encode_computed(field):
+    """Encode a field whose value is filled in by pack, without that value"""
+    enc = _encode(field)
+    enc[1] = 0
+    return enc
+
+
+def _encode(node):
+    # pylint: disable=too-many-return-statements
+    cls = type(node)
+    name = cls.__name__
+    if cls in _BYTES:
+        return [name, node._value]
+    if cls in _WORDS:
+        return [name, node._value, node._endian]
+    if cls is BFBuffer:
+        return [name, base64.b64encode(node._value).decode("ascii")]
+    if cls is BFArray:
+        count_field = None
+        if node._count_field is not None:
+            count_field = _encode_computed(node._count_field)
+        big = (sys.byteorder == "big") != node._swap
+        return [
+            name,
+            node._typecode,
+            ">" if big else "<",
+            count_field,
+            sys.byteorder,
+            base64.b64encode(node._value.tobytes()).decode("ascii"),
+        ]
+    if cls is BFBitField:
+        fields = [
+            [field, mask.bit_length()] for field, (_, mask) in node._fields.items()
+        ]
+        return [name, _encode(node._word), fields]
+    if cls is BFLength:
+        return [name, _encode_computed(node._field), _encode(node._children["_data"])]
+    if cls is BFLengthRef:
+        return [name, _encode_computed(node._field), node._ref]
+    if cls is BFOffsetRef:
+        return [name, _encode_computed(node._field), node._ref, node._base_ref]
+    if cls is BFCallableRef:
+        return [name, _encode_computed(node._field), _func_name(node._func), node._ref]
+    if cls is BFContainer:
+        return [
+            name,
+            [[child, _encode(obj)] for child, obj in node._children.items()],
+        ]
+    raise BFTypeException(f"Cannot cache {name}")
+
+
+def _decode_array(cls, enc):
+    _, typecode, endian, count_field, byteorder, data = enc
+    values = array.array(typecode, base64.b64decode(data))
+    if byteorder != sys.byteorder:
+        values.byteswap()
+    return cls(
+        typecode,
+        values,
+        endian=_ENDIAN[endian],
+        count_field=_decode(count_field) if count_field else None,
+    )
+
+
+def _decode_container(cls, enc):
+    container = cls()
+    children = container._children
+    for child_name, child_enc in enc[1]:
+        child = _decode(child_enc)
+        child._parent = container
+        if isinstance(child, BFContainer):
+            child._name = child_name
+        children[child_name] = child
+    return container
+
+
+def _decode(enc):
+    # pylint: disable=too-many-return-statements
+    name = enc[0]
+    cls = _TYPES.get(name)
+    if cls is None:
+        raise BFTypeException(f"Unknown type in cached schema: {name}")
+    if cls in _BYTES:
+        return cls(value=enc[1])
+    if cls in _WORDS:
+        return cls(value=enc[1], endian=_ENDIAN[enc[2]])
+    if cls is BFContainer:
+        return _decode_container(cls, enc)
+    if cls is BFBuffer:
+        return cls(value=base64.b64decode(enc[1]))
+    if cls is BFArray:
+        return _decode_array(cls, enc)
+    if cls is BFBitField:
+        return cls(_decode(enc[1]), [tuple(field) for field in enc[2]])
+    if cls is BFLength:
+        return cls(_decode(enc[1]), _decode(enc[2]))
+    if cls is BFLengthRef:
+        return cls(_decode(enc[1]), enc[2])
+    if cls is BFOffsetRef:
+        return cls(_decode(enc[1]), enc[2], enc[3])
+    return cls(_decode(enc[1]), _import_func(enc[2]), enc[3])
+
+
+class BFSchemaCache:
+    """On-disk cache of templates keyed by a hash of their schema
+
+    Args:
+        directory: where cached schemas are stored, created if missing
+
+    Templates are stored as <digest>.schema, and get() keeps a <name>.ref
+    file pointing a name at the digest of the template it built. Loading a
+    template imports the modules of its BFCallableRef functions, so the
+    directory must only be writable by trusted users.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def _digest(schema):
+        return hashlib.sha256(schema).hexdigest()
+
+    @staticmethod
+    def dumps(template):
+        """Serialize a template, returns (digest, bytes)"""
+        schema = json.dumps(_encode(template), separators=(",", ":")).encode("utf-8")
+        digest = BFSchemaCache._digest(schema)
+        header = f'{{"version":{FORMAT_VERSION},"digest":"{digest}"}}\n'
+        return digest, header.encode("utf-8") + schema
+
+    @staticmethod
+    def loads(data, digest=None):
+        """Rebuild a template from BFSchemaCache.dumps output
+
+        Args:
+            data: serialized template
+            digest: optional digest the template must have
+
+        Raises BFTypeException if the document is malformed, its digest does
+        not match its schema or a function it refers to cannot be imported.
+        """
+        try:
+            header, schema = data.split(b"\n", 1)
+            header = json.loads(header)
+            if header["version"] != FORMAT_VERSION:
+                raise BFTypeException("Cached schema has an unsupported format version")
+            # The schema is hashed as stored, before _decode imports anything
+            # it names
+            actual = BFSchemaCache._digest(schema)
+            if header["digest"] != actual or digest not in (None, actual):
+                raise BFTypeException("Cached schema does not match its digest")
+            return _decode(json.loads(schema))
+        except (KeyError, IndexError, TypeError, ValueError) as exc:
+            raise BFTypeException("Cached schema is malformed") from exc
+
+    def _path(self, name):
+        return os.path.join(self._directory, name)
+
+    def save(self, template):
+        """Store template and return its digest
+
+        A file already stored under the digest is kept only if it holds
+        exactly this template, corrupt or stale files are written again.
+        """
+        digest, data = self.dumps(template)
+        path = self._path(digest + ".schema")
+        try:
+            with open(path, "rb") as handle:
+                stored = handle.read()
+        except OSError:
+            stored = None
+        if stored != data:
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as handle:
+                handle.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def load(self, digest):
+        """Rebuild the template stored under digest, None if missing or stale"""
+        try:
+            with open(self._path(digest + ".schema"), "rb") as handle:
+                return self.loads(handle.read(), digest)
+        except (OSError, BFTypeException):
+            return None
+
+    def get(self, name, builder):
+        """Load the template cached for name, or build, save and return it
+
+        Args:
+            name: key for the template, include a version to invalidate it
+            builder: callable returning the template when it is not cached
+        """
+        ref = self._path(name + ".ref")
+        try:
+            with open(ref, encoding="ascii") as handle:
+                template = self.load(handle.read().strip())
+            if template is not None:
+                return template
+        except OSError:
+            pass
+
+        template = builder()
+        digest = self.save(template)
+        tmp = f"{ref}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="ascii") as handle:
+            handle.write(digest)
+        os.replace(tmp, ref)
+        return template
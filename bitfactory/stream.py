@@ -0,0 +1,352 @@
+"""BitFactory streaming helpers
+
+Readers and asyncio adapters for streams of records framed by a BFLength
+prefix.
+"""
+
+import asyncio
+import time
+
+from .bitfactory import (
+    BFArray,
+    BFBasicDataType,
+    BFBuffer,
+    BFCallableRef,
+    BFContainer,
+    BFLength,
+    BFLengthRef,
+)
+from .exceptions import BFRangeException, BFTypeException
+
+
+def _static_width(node):
+    """Returns the packed width of node, or None if it depends on the data"""
+    if isinstance(node, BFLength):
+        return None
+    if isinstance(node, (BFLengthRef, BFCallableRef)):
+        return node._field.length
+    if isinstance(node, BFContainer):
+        widths = [_static_width(child) for child in node._children.values()]
+        return None if None in widths else sum(widths)
+    # Empty buffers and arrays take the rest of their region, counted arrays
+    # hold as many elements as their count field says
+    variable = (isinstance(node, BFBuffer) and not node.length) or (
+        isinstance(node, BFArray) and (node._count_field is not None or len(node) == 0)
+    )
+    return None if variable else node.length
+
+
+class _BFFraming:  # pylint: disable=too-few-public-methods
+    """Finds record boundaries for a schema framed by a BFLength
+
+    The schema is either a BFLength, or a BFContainer holding one BFLength
+    with only fixed width fields before and after it.
+    """
+
+    def __init__(self, schema):
+        if isinstance(schema, BFLength):
+            self.header = 0
+            self.field = schema._field
+            self.trailer = 0
+        elif isinstance(schema, BFContainer):
+            self.field = None
+            self.header = 0
+            self.trailer = 0
+            for child in schema._children.values():
+                if self.field is None and isinstance(child, BFLength):
+                    self.field = child._field
+                    continue
+                width = _static_width(child)
+                if width is None:
+                    raise BFTypeException(
+                        "Schema must have fixed width fields around one BFLength"
+                    )
+                if self.field is None:
+                    self.header += width
+                else:
+                    self.trailer += width
+            if self.field is None:
+                raise BFTypeException("Schema has no BFLength to frame records")
+        else:
+            raise BFTypeException("Schema must be a BFContainer or BFLength")
+
+        # Bytes needed before the size of a record is known
+        self.prefix = self.header + self.field.length
+
+    def record_size(self, buf, offset):
+        """Size of the record starting at buf[offset], the prefix must be present"""
+        count = self.field._unpack_from(buf, offset + self.header)
+        return self.prefix + count + self.trailer
+
+
+class BFRecordReader:
+    """Yields records from a stream of BFLength framed messages
+
+    Args:
+        schema: BFLength, or BFContainer with a BFLength, describing a record
+        source: file object (readinto), socket (recv_into) or a buffer such
+            as bytes or mmap
+        chunk_size: size of reads from file objects and sockets
+
+    Memory stays at max(chunk_size, largest record) regardless of the size
+    of the stream. Each record is yielded as bytes.
+    """
+
+    def __init__(self, schema, source, chunk_size=1 << 16):
+        self._framing = _BFFraming(schema)
+        self._source = source
+        self._chunk_size = max(chunk_size, self._framing.prefix)
+        self.records = 0
+        self.bytes_read = 0
+        self._started = None
+        self._stopped = None
+
+    @property
+    def elapsed(self):
+        """Seconds spent reading so far"""
+        if self._started is None:
+            return 0.0
+        stopped = self._stopped if self._stopped is not None else time.perf_counter()
+        return stopped - self._started
+
+    @property
+    def throughput(self):
+        """Bytes read per second"""
+        elapsed = self.elapsed
+        return self.bytes_read / elapsed if elapsed else 0.0
+
+    @property
+    def record_rate(self):
+        """Records read per second"""
+        elapsed = self.elapsed
+        return self.records / elapsed if elapsed else 0.0
+
+    def __iter__(self):
+        self._started = time.perf_counter()
+        self._stopped = None
+        try:
+            if hasattr(self._source, "readinto"):
+                yield from self._read_stream(self._source.readinto)
+            elif hasattr(self._source, "recv_into"):
+                yield from self._read_stream(self._source.recv_into)
+            else:
+                yield from self._read_buffer(memoryview(self._source))
+        finally:
+            self._stopped = time.perf_counter()
+
+    def _read_buffer(self, view):
+        framing = self._framing
+        end = len(view)
+        offset = 0
+        while offset < end:
+            if end - offset < framing.prefix:
+                raise BFRangeException(f"Truncated record at offset {offset}")
+            size = framing.record_size(view, offset)
+            if offset + size > end:
+                raise BFRangeException(f"Truncated record at offset {offset}")
+            self.bytes_read += size
+            yield bytes(view[offset : offset + size])
+            self.records += 1
+            offset += size
+
+    def _read_stream(self, read_into):
+        framing = self._framing
+        buf = bytearray(self._chunk_size)
+        view = memoryview(buf)
+        start = end = 0
+        stream_offset = 0
+        while True:
+            size = None
+            if end - start >= framing.prefix:
+                size = framing.record_size(buf, start)
+                if end - start >= size:
+                    yield bytes(view[start : start + size])
+                    self.records += 1
+                    start += size
+                    stream_offset += size
+                    continue
+
+            # Keep the partial record and refill the rest of the buffer
+            pending = end - start
+            if start:
+                view[:pending] = buf[start:end]
+                start, end = 0, pending
+            needed = size if size is not None else framing.prefix
+            if needed > len(buf):
+                view.release()
+                buf.extend(bytes(needed - len(buf)))
+                view = memoryview(buf)
+
+            count = read_into(view[end:])
+            if not count:
+                if pending:
+                    raise BFRangeException(
+                        f"Truncated record at offset {stream_offset}"
+                    )
+                return
+            end += count
+            self.bytes_read += count
+
+
+class BFFramingProtocol(asyncio.Protocol):
+    """asyncio Protocol that splits a byte stream into BFLength framed records
+
+    Args:
+        schema: BFLength, or BFContainer with a BFLength, describing a record
+        on_frame: optional callable(protocol, frame) for each record, used by
+            the default frame_received
+        verify: check each record with schema.verify before delivering it
+
+    Received data is appended to one buffer and records are delivered as
+    bytes, consumed data is dropped from the front of the buffer once per
+    data_received call. Delivery stops once the transport is closing.
+
+    Messages passed to send() are packed and written together with a single
+    writelines() per event loop iteration. While the transport has paused
+    writing they are held back and reading is paused too, so senders
+    driven by frame_received stop with it. Other senders should await
+    drain() so that they do not queue without limit.
+    """
+
+    def __init__(self, schema, on_frame=None, verify=False):
+        self._schema = schema
+        self._framing = _BFFraming(schema)
+        self._on_frame = on_frame
+        self._verify = verify
+        self._buffer = bytearray()
+        self._pending = []
+        self._flush_handle = None
+        self._paused = False
+        self._drain_waiter = None
+        self.transport = None
+        self.frames_received = 0
+        self.frames_sent = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._pending.clear()
+        self.transport = None
+        self._wake_drain()
+
+    def data_received(self, data):
+        buf = self._buffer
+        buf += data
+        framing = self._framing
+        start = 0
+        end = len(buf)
+        view = memoryview(buf)
+        try:
+            while end - start >= framing.prefix:
+                size = framing.record_size(buf, start)
+                if end - start < size:
+                    break
+                frame = bytes(view[start : start + size])
+                start += size
+                self.frames_received += 1
+                errors = self._verify and self._schema.verify(frame)
+                if errors:
+                    self.frame_error(frame, errors)
+                else:
+                    self.frame_received(frame)
+                if self.transport is not None and self.transport.is_closing():
+                    break
+        finally:
+            view.release()
+            if start:
+                del buf[:start]
+
+    def frame_received(self, frame):
+        """Called with each complete record, override or pass on_frame"""
+        if self._on_frame is not None:
+            self._on_frame(self, frame)
+
+    def frame_error(self, frame, errors):  # pylint: disable=unused-argument
+        """Called when verify is set and a record fails it, closes by default"""
+        if self.transport is not None:
+            self.transport.close()
+
+    def send(self, message):
+        """Queue a BFContainer (packed here) or bytes for the next batched write"""
+        if isinstance(message, BFBasicDataType):
+            message = message.pack()
+        self._pending.append(message)
+        self.frames_sent += 1
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        if self.transport is None or self._paused or not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        self.transport.writelines(pending)
+
+    def pause_writing(self):
+        self._paused = True
+        # Stop taking in frames that frame_received would answer
+        if self.transport is not None:
+            self.transport.pause_reading()
+
+    def resume_writing(self):
+        self._paused = False
+        if self.transport is not None:
+            self.transport.resume_reading()
+        self._flush()
+        self._wake_drain()
+
+    def _wake_drain(self):
+        waiter, self._drain_waiter = self._drain_waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def drain(self):
+        """Wait until the transport accepts writes again after pause_writing"""
+        if self._paused and self.transport is not None:
+            if self._drain_waiter is None:
+                self._drain_waiter = asyncio.get_running_loop().create_future()
+            await self._drain_waiter
+        if self.transport is None:
+            raise ConnectionResetError("Connection lost")
+
+
+class BFStreamReader:
+    """Reads BFLength framed records from an asyncio.StreamReader
+
+    Args:
+        reader: asyncio.StreamReader
+        schema: BFLength, or BFContainer with a BFLength, describing a record
+    """
+
+    def __init__(self, reader, schema):
+        self._reader = reader
+        self._framing = _BFFraming(schema)
+
+    async def read(self):
+        """Returns the next record as bytes, or None at end of stream"""
+        framing = self._framing
+        try:
+            prefix = await self._reader.readexactly(framing.prefix)
+        except asyncio.IncompleteReadError as exc:
+            if not exc.partial:
+                return None
+            raise BFRangeException("Truncated record") from exc
+        size = framing.record_size(prefix, 0)
+        try:
+            rest = await self._reader.readexactly(size - framing.prefix)
+        except asyncio.IncompleteReadError as exc:
+            raise BFRangeException("Truncated record") from exc
+        return prefix + rest
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        record = await self.read()
+        if record is None:
+            raise StopAsyncIteration
+        return record
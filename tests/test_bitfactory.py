@@ -1,10 +1,19 @@
-# pylint: disable=too-few-public-methods
+# pylint: disable=too-few-public-methods,too-many-lines
 """BitFactory test suite
 """
+import asyncio
+import hashlib
+import io
+import mmap
+import os
+import socket
+import tempfile
+import threading
+
 import pytest
 
 from bitfactory import *  # pylint: disable=W0401,W0614
-from bitfactory.exceptions import BFRangeException
+from bitfactory.exceptions import BFRangeException, BFTypeException
 
 
 class TestBFUInt8():
@@ -275,6 +284,269 @@ class TestBFLengthRef():
         )
 
 
+class TestBFBitField():
+    """Test bit fields packed into one word"""
+
+    def test(self):
+        bf_test = BFBitField(BFUInt8(), [("version", 4), ("ihl", 4)])
+        bf_test.version = 4
+        bf_test.ihl = 5
+        assert b"\x45" == bf_test.pack()
+        assert bf_test.version == 4
+        assert bf_test.ihl == 5
+        assert bf_test.length == 1
+
+        # Values are truncated to the width of the field
+        bf_test.ihl = 0x1F
+        assert b"\x4f" == bf_test.pack()
+
+        bf_test.value = 0x61
+        assert bf_test.version == 6
+        assert bf_test.ihl == 1
+
+        bf_test = BFBitField(
+            BFUInt16(endian=BFEndian.BIG), [("flags", 3), ("offset", 13)]
+        )
+        bf_test.update(flags=0b010, offset=0x123)
+        assert b"\x41\x23" == bf_test.pack()
+        assert {"flags": 2, "offset": 0x123} == dict(bf_test.fields)
+
+        bf_test = BFBitField(BFUInt16(), [("flags", 3), ("offset", 13)])
+        bf_test.update(flags=0b010, offset=0x123)
+        assert b"\x23\x41" == bf_test.pack()
+
+        # Bytes set the packed word in its own byte order
+        for endian in (BFEndian.BIG, BFEndian.LITTLE):
+            bf_test = BFBitField(BFUInt16(endian=endian), [("a", 8), ("b", 8)])
+            bf_test.value = b"\x12\x34"
+            assert b"\x12\x34" == bf_test.pack()
+        assert (bf_test.a, bf_test.b) == (0x34, 0x12)
+        with pytest.raises(BFRangeException):
+            bf_test.value = b"\x12"
+
+        # Unused low bits are padding
+        bf_test = BFBitField(BFUInt8(), [("syn", 1), ("ack", 1)])
+        bf_test.ack = 1
+        assert b"\x40" == bf_test.pack()
+
+        with pytest.raises(BFRangeException):
+            BFBitField(BFUInt8(), [("a", 4), ("b", 5)])
+
+        # Names may not shadow attributes and the word must be unsigned
+        for name in ("value", "length", "fields", "update", "_a"):
+            with pytest.raises(BFTypeException):
+                BFBitField(BFUInt8(), [(name, 4), ("b", 4)])
+        with pytest.raises(BFTypeException):
+            BFBitField(BFSInt8(), [("a", 4), ("b", 4)])
+
+        bf_test = BFContainer()
+        bf_test.flags = BFBitField(BFUInt8(), [("version", 4), ("ihl", 4)])
+        bf_test.flags.version = 4
+        bf_test.data = BFUInt8(value=1)
+        assert b"\x40\x01" == bf_test.pack()
+        assert "version=0x4" in str(bf_test)
+
+
+class TestBFArray():
+    """Test array of primitives"""
+
+    def test(self):
+        bf_test = BFArray(BFUInt16, [1, 2, 0x1234])
+        assert b"\x01\x00\x02\x00\x34\x12" == bf_test.pack()
+        assert bf_test.length == 6
+        assert len(bf_test) == 3
+        assert bf_test[2] == 0x1234
+
+        bf_test = BFArray(BFUInt16, [1, 2, 0x1234], endian=BFEndian.BIG)
+        assert b"\x00\x01\x00\x02\x12\x34" == bf_test.pack()
+        # Packing must not byteswap the stored values
+        assert [1, 2, 0x1234] == list(bf_test)
+
+        bf_test[0] = 0xFFFF
+        assert b"\xff\xff" == bf_test.pack()[:2]
+        with pytest.raises(BFRangeException):
+            bf_test[0] = 0x10000
+        with pytest.raises(BFRangeException):
+            BFArray(BFUInt8, [256])
+
+        bf_test = BFArray(BFSInt32, [-1], endian=BFEndian.BIG)
+        assert b"\xff\xff\xff\xff" == bf_test.pack()
+
+        bf_test = BFArray("Q", [1], endian=BFEndian.BIG)
+        assert b"\x00" * 7 + b"\x01" == bf_test.pack()
+        bf_test = BFArray("f", [1.0])
+        assert b"\x00\x00\x80\x3f" == bf_test.pack()
+
+        bf_test = BFArray(BFUInt16, b"\x00\x01\x00\x02", endian=BFEndian.BIG)
+        assert [1, 2] == list(bf_test)
+
+        # Element count prefix
+        bf_test = BFArray(BFUInt16, [1, 2], count_field=BFUInt8())
+        assert b"\x02\x01\x00\x02\x00" == bf_test.pack()
+        assert bf_test.length == 5
+
+        # Byte length prefix
+        bf_test = BFContainer()
+        bf_test.table = BFLength(BFUInt16(), BFArray(BFUInt16, range(4)))
+        assert b"\x08\x00\x00\x00\x01\x00\x02\x00\x03\x00" == bf_test.pack()
+        assert "Array H[4]" in str(bf_test)
+
+        template = BFContainer()
+        template.table = BFLength(BFUInt16(), BFArray(BFUInt16))
+        assert not template.verify(bf_test.pack())
+        assert template.verify(bf_test.pack()[:2] + b"\x00" * 9)
+
+        with pytest.raises(BFTypeException):
+            BFArray(BFBuffer)
+
+        # Size changes reach cached lengths and offsets of the tree
+        bf_test = BFContainer()
+        bf_test.ptr = BFOffsetRef(BFUInt8(), "tail")
+        bf_test.arr = BFArray(BFUInt16, [1, 2])
+        bf_test.tail = BFUInt8()
+        assert b"\x05\x01\x00\x02\x00\x00" == bf_test.pack()
+        bf_test.arr.value.append(3)
+        assert bf_test.length == 6
+        bf_test.arr.append(3)
+        assert bf_test.length == 8
+        bf_test.arr.extend([4])
+        assert b"\x09\x01\x00\x02\x00\x03\x00\x04\x00\x00" == bf_test.pack()
+        with pytest.raises(BFRangeException):
+            bf_test.arr.append(0x10000)
+
+
+class TestHash():
+    """Test structural and content hashing"""
+
+    @staticmethod
+    def _message(value):
+        bf_test = BFContainer()
+        bf_test.type = BFUInt8(value=1)
+        bf_test.body = BFLength(BFUInt16(), BFContainer())
+        bf_test.body.data = BFContainer()
+        bf_test.body.data.value = BFUInt32(value=value)
+        bf_test.body.data.flags = BFBitField(BFUInt8(), [("a", 4), ("b", 4)])
+        bf_test.body.data.table = BFArray(BFUInt16, [1, 2])
+        bf_test.body.data.payload = BFBuffer(value=b"abc")
+        return bf_test
+
+    def test(self):
+        first = self._message(1)
+        second = self._message(1)
+        other = self._message(2)
+        assert first == second
+        assert hash(first) == hash(second)
+        assert first != other
+        assert first.structure_hash == other.structure_hash
+        assert 2 == len({first, second, other})
+
+        # Value setters deep in the tree invalidate the cached hashes
+        hash(second)
+        second.body.data.value.value = 2
+        assert second == other
+        assert hash(second) == hash(other)
+
+        second.body.data.flags.b = 3
+        assert second != other
+        other.body.data.flags.update(b=3)
+        assert second == other
+
+        second.body.data.table[0] = 7
+        assert second != other
+        other.body.data.table.value = [7, 2]
+        assert second == other
+
+        second.body.data.payload.value = b"abcd"
+        assert second != other
+        other.body.data.payload = BFBuffer(value=b"abcd")
+        assert second == other
+
+        # Replacing a child keeps the hash in step with a fresh tree
+        hash(second)
+        replaced = second.body.data.value
+        second.body.data.value = BFUInt32(value=5)
+        replaced.value = 9
+        other.body.data.value.value = 5
+        assert hash(second) == hash(other)
+        assert second == other
+
+        # Adding a field changes the structure
+        structure = second.structure_hash
+        second.body.data.extra = BFUInt8()
+        assert second.structure_hash != structure
+        assert second != other
+
+        # Endianness is part of the structure
+        assert BFUInt16(value=1) != BFUInt16(value=1, endian=BFEndian.BIG)
+        assert BFUInt16(value=1) == BFUInt16(value=1)
+        assert BFUInt8(value=1) != BFSInt8(value=1)
+
+
+class TestBFOffsetRef():
+    """Test offset reference fields"""
+
+    def test(self):
+        bf_test = BFContainer()
+        bf_test.magic = BFUInt16(value=0xCAFE)
+        bf_test.first = BFOffsetRef(BFUInt16(), "files.a")
+        bf_test.second = BFOffsetRef(BFUInt16(endian=BFEndian.BIG), "files.b")
+        bf_test.relative = BFOffsetRef(BFUInt8(), "files.b", "files")
+        bf_test.files = BFContainer()
+        bf_test.files.a = BFBuffer(value=b"aaa")
+        bf_test.files.b = BFBuffer(value=b"bb")
+        assert b"\xfe\xca\x07\x00\x00\x0a\x03aaabb" == bf_test.pack()
+        assert bf_test.first.value == 7
+
+        # Offsets follow size changes before the target
+        bf_test.files.a.value = b"aaaa"
+        assert b"\xfe\xca\x07\x00\x00\x0b\x04aaaabb" == bf_test.pack()
+        assert "offset: 0xb" in str(bf_test)
+
+        # Inside a BFLength offsets are relative to its body
+        bf_test = BFContainer()
+        bf_test.body = BFLength(BFUInt8(), BFContainer())
+        bf_test.body.ptr = BFOffsetRef(BFUInt8(), "data")
+        bf_test.body.pad = BFUInt16()
+        bf_test.body.data = BFUInt8(value=0x55)
+        assert b"\x04\x03\x00\x00\x55" == bf_test.pack()
+
+        assert not bf_test.verify(bf_test.pack())
+        errors = bf_test.verify(b"\x04\x02\x00\x00\x55")
+        assert [("body.ptr", 1)] == [(e.path, e.offset) for e in errors]
+
+        # Offsets after a BFLength whose body changes size
+        bf_test = BFContainer()
+        bf_test.ptr = BFOffsetRef(BFUInt8(), "tail")
+        bf_test.body = BFLength(BFUInt8(), BFContainer())
+        bf_test.body.payload = BFBuffer(value=b"abc")
+        bf_test.tail = BFUInt8()
+        assert b"\x05\x03abc\x00" == bf_test.pack()
+        bf_test.body.payload.value = b"abcdef"
+        assert b"\x08\x06abcdef\x00" == bf_test.pack()
+
+        # A directory of pointers to entries after it
+        bf_test = BFContainer()
+        bf_test.directory = BFContainer()
+        bf_test.entries = BFContainer()
+        for i in range(2000):
+            pointer = BFOffsetRef(BFUInt32(), f"entries.e{i}")
+            setattr(bf_test.directory, f"e{i}", pointer)
+            setattr(bf_test.entries, f"e{i}", BFBuffer(value=b"x" * (i % 7)))
+        data = bf_test.pack()
+        offset = 8000
+        for i in range(2000):
+            assert offset == int.from_bytes(data[4 * i : 4 * i + 4], "little")
+            offset += i % 7
+
+        other = BFSchemaCache.loads(BFSchemaCache.dumps(bf_test)[1])
+        assert data == other.pack()
+        other.entries.e0.value = b"y"
+        paths = [entry.path for entry in bf_test.diff(other)]
+        assert "entries.e0" in paths
+        assert "directory.e1" in paths
+        assert "directory.e0" not in paths
+
+
 def csum(data: bytes) -> int:
     checksum = 0
     for value in data:
@@ -320,6 +592,464 @@ class TestBFCallableRef():
         )
 
 
+class TestBFVerify():
+    """Test verifying a buffer against a template"""
+
+    def test(self):
+        bf_test = BFContainer()
+        bf_test.type = BFUInt8(value=1)
+        bf_test.body = BFLength(BFUInt16(endian=BFEndian.BIG), BFContainer())
+        bf_test.body.csum_data = BFContainer()
+        bf_test.body.csum_data.data = BFUInt32(value=0xAABBCCDD)
+        bf_test.body.csum_data.data2 = BFUInt8(value=10)
+        bf_test.body.csum = BFCallableRef(BFUInt16(), csum, "csum_data")
+        data = bf_test.pack()
+        assert not bf_test.verify(data)
+        assert not bf_test.verify(bytearray(data))
+
+        errors = bf_test.verify(data[:-1])
+        assert len(errors) == 1
+        assert errors[0].path == "body"
+        assert errors[0].offset == 1
+
+        errors = bf_test.verify(data[:3] + b"\x00" + data[4:])
+        assert [("body.csum", 8)] == [(e.path, e.offset) for e in errors]
+
+        errors = bf_test.verify(b"\x01\x00\x08" + data[3:] + b"\x00")
+        assert [("body", 1)] == [(e.path, e.offset) for e in errors]
+
+        errors = bf_test.verify(data + b"\x00")
+        assert [("", len(data))] == [(e.path, e.offset) for e in errors]
+
+        errors = bf_test.verify(data[:2])
+        assert [("body", 1)] == [(e.path, e.offset) for e in errors]
+
+        bf_test = BFContainer()
+        bf_test.len = BFLengthRef(BFUInt8(), "payload")
+        bf_test.payload = BFContainer()
+        bf_test.payload.data = BFUInt32(value=0x1337)
+        assert not bf_test.verify(bf_test.pack())
+        errors = bf_test.verify(b"\x05" + bf_test.pack()[1:])
+        assert [("len", 0)] == [(e.path, e.offset) for e in errors]
+
+        # An empty buffer in the template takes the rest of its length region
+        bf_test = BFContainer()
+        bf_test.body = BFLength(BFUInt8(), BFContainer())
+        bf_test.body.kind = BFUInt8(value=2)
+        bf_test.body.payload = BFBuffer()
+        bf_test.tail = BFUInt8(value=0xFF)
+        assert not bf_test.verify(b"\x04\x02abc\xff")
+        assert not bf_test.verify(b"\x01\x02\xff")
+
+
+class TestBFRecordReader():
+    """Test reading a stream of length framed records"""
+
+    @staticmethod
+    def _records():
+        schema = BFContainer()
+        schema.type = BFUInt8(value=1)
+        schema.body = BFLength(BFUInt16(endian=BFEndian.BIG), BFContainer())
+        schema.body.payload = BFBuffer()
+
+        records = []
+        for size in (0, 1, 5, 300, 7):
+            record = BFContainer()
+            record.type = BFUInt8(value=size & 0xFF)
+            record.body = BFLength(BFUInt16(endian=BFEndian.BIG), BFContainer())
+            record.body.payload = BFBuffer(value=bytes([size & 0xFF]) * size)
+            records.append(record.pack())
+        return schema, records
+
+    def test(self):
+        schema, records = self._records()
+        stream = b"".join(records)
+
+        # Chunks smaller than a record and records split across chunks
+        reader = BFRecordReader(schema, io.BytesIO(stream), chunk_size=4)
+        assert records == list(reader)
+        assert reader.records == len(records)
+        assert reader.bytes_read == len(stream)
+        assert reader.throughput > 0
+
+        assert records == list(BFRecordReader(schema, stream))
+
+        # Counters follow the records yielded so far
+        reader = BFRecordReader(schema, stream)
+        for _ in reader:
+            break
+        assert reader.bytes_read == len(records[0])
+
+        with tempfile.TemporaryFile() as tmp:
+            tmp.write(stream)
+            tmp.flush()
+            with mmap.mmap(tmp.fileno(), 0) as mapped:
+                assert records == list(BFRecordReader(schema, mapped))
+
+        left, right = socket.socketpair()
+        with left, right:
+            left.sendall(stream)
+            left.shutdown(socket.SHUT_WR)
+            assert records == list(BFRecordReader(schema, right, chunk_size=16))
+
+        with pytest.raises(BFRangeException):
+            list(BFRecordReader(schema, io.BytesIO(stream[:-1])))
+        with pytest.raises(BFRangeException):
+            list(BFRecordReader(schema, stream[:-1]))
+
+        length_only = BFLength(BFUInt8(), BFContainer())
+        assert [b"\x00", b"\x02ab"] == list(
+            BFRecordReader(length_only, io.BytesIO(b"\x00\x02ab"))
+        )
+
+
+class _Transport:
+    """Minimal transport recording writes"""
+
+    def __init__(self):
+        self.closed = False
+        self.reading = True
+        self.written = []
+
+    def close(self):
+        self.closed = True
+
+    def is_closing(self):
+        return self.closed
+
+    def writelines(self, data):
+        self.written.extend(data)
+
+    def pause_reading(self):
+        self.reading = False
+
+    def resume_reading(self):
+        self.reading = True
+
+
+class TestBFFramingProtocol():
+    """Test asyncio framing over a loopback connection"""
+
+    def test(self):
+        schema, records = TestBFRecordReader._records()
+
+        def echo():
+            return BFFramingProtocol(schema, lambda proto, frame: proto.send(frame))
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            server = await loop.create_server(
+                echo,
+                "127.0.0.1",
+                0,
+            )
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            stream = b"".join(records)
+            # Dribble the data so frames are split across data_received calls
+            for i in range(0, len(stream), 3):
+                writer.write(stream[i : i + 3])
+                await writer.drain()
+            received = []
+            async for record in BFStreamReader(reader, schema):
+                received.append(record)
+                if len(received) == len(records):
+                    break
+            writer.close()
+            await writer.wait_closed()
+            server.close()
+            await server.wait_closed()
+            return received
+
+        assert records == asyncio.run(run())
+
+        frames = []
+        proto = BFFramingProtocol(schema, lambda proto, frame: frames.append(frame))
+        stream = b"".join(records)
+        proto.data_received(stream[:2])
+        proto.data_received(stream[2:-1])
+        assert records[:-1] == frames
+        proto.data_received(stream[-1:])
+        assert records == frames
+        assert proto.frames_received == len(records)
+
+        # Nothing more is delivered once a bad frame closes the transport
+        schema = BFLength(BFUInt8(), BFContainer())
+        schema.data = BFContainer()
+        schema.data.x = BFUInt8()
+        schema.csum = BFCallableRef(BFUInt8(), csum, "data")
+        frames = []
+        proto = BFFramingProtocol(
+            schema, lambda proto, frame: frames.append(frame), verify=True
+        )
+        transport = _Transport()
+        proto.connection_made(transport)
+        proto.data_received(b"\x02\x05\x05\x02\x05\x06\x02\x07\x07")
+        assert [b"\x02\x05\x05"] == frames
+        assert transport.closed
+
+
+class TestBFFramingProtocolFlow():
+    """Test that writes are held back while the transport is paused"""
+
+    def test(self):
+        schema, _ = TestBFRecordReader._records()
+
+        async def flow():
+            proto = BFFramingProtocol(schema)
+            transport = _Transport()
+            proto.connection_made(transport)
+            proto.pause_writing()
+            proto.send(b"a")
+            drained = asyncio.ensure_future(proto.drain())
+            await asyncio.sleep(0)
+            assert not transport.written
+            assert not transport.reading
+            assert not drained.done()
+            proto.resume_writing()
+            await drained
+            assert [b"a"] == transport.written
+            assert transport.reading
+            proto.connection_lost(None)
+            with pytest.raises(ConnectionResetError):
+                await proto.drain()
+
+        asyncio.run(flow())
+
+
+class TestBFProfiler():
+    """Test per node pack profiling"""
+
+    def test(self):
+        bf_test = BFContainer()
+        bf_test.type = BFUInt8(value=1)
+        bf_test.body = BFLength(BFUInt16(), BFContainer())
+        bf_test.body.csum_data = BFContainer()
+        bf_test.body.csum_data.data = BFUInt32(value=0xAABBCCDD)
+        bf_test.body.csum = BFCallableRef(BFUInt16(), csum, "csum_data")
+        expected = bf_test.pack()
+
+        hooked = []
+        with BFProfiler() as prof:
+            prof.add_hook(lambda path, node, elapsed, nbytes: hooked.append(path))
+            assert expected == bf_test.pack()
+            assert expected == bf_test.pack()
+
+        assert prof.packs == 2
+        assert prof.paths[""].calls == 2
+        assert prof.paths[""].bytes == 2 * len(expected)
+        assert prof.paths["body"].calls == 2
+        # Packed once by its container and once more by the checksum
+        assert prof.paths["body.csum_data"].calls == 4
+        assert prof.paths["body.csum_data.data"].calls == 4
+        assert prof.types["BFUInt32"].calls == 4
+        assert prof.types["BFCallableRef"].bytes == 4
+        assert "body.csum_data" in prof.report()
+        assert hooked.count("body.csum_data") == 4
+
+        # Reading computed values and packing on other threads is not counted
+        with prof:
+            assert bf_test.body.csum.value
+            assert bf_test.body.value == len(expected) - 3
+            thread = threading.Thread(target=bf_test.pack)
+            thread.start()
+            thread.join()
+        assert prof.packs == 2
+        assert prof.paths["body.csum_data"].calls == 4
+
+        # Nothing is recorded once the profiler is inactive
+        bf_test.pack()
+        assert prof.packs == 2
+
+
+class TestTrace():
+    """Test tracing of tree construction"""
+
+    def test(self, caplog):
+        caplog.set_level("DEBUG", logger="bitfactory")
+        bf_test = BFContainer()
+        bf_test.test = BFUInt8(value=1)
+        assert not caplog.records
+
+        set_trace()
+        try:
+            bf_test.test2 = BFUInt8(value=2)
+            str(bf_test)
+        finally:
+            set_trace(False)
+        messages = [record.getMessage() for record in caplog.records]
+        assert "SETTER: test2" in messages
+        assert "current child: test2 (0)" in messages
+
+
+class TestDiff():
+    """Test diffing two trees of the same schema"""
+
+    @staticmethod
+    def _message():
+        bf_test = BFContainer()
+        bf_test.type = BFUInt8(value=1)
+        bf_test.len = BFLengthRef(BFUInt8(), "body")
+        bf_test.body = BFLength(BFUInt16(), BFContainer())
+        bf_test.body.csum_data = BFContainer()
+        bf_test.body.csum_data.data = BFUInt32(value=0xAABBCCDD)
+        bf_test.body.csum_data.payload = BFBuffer(value=b"abc")
+        bf_test.body.csum = BFCallableRef(BFUInt16(), csum, "csum_data")
+        bf_test.tail = BFContainer()
+        bf_test.tail.value = BFUInt16(value=0x1234)
+        return bf_test
+
+    def test(self):
+        first = self._message()
+        second = self._message()
+        assert not first.diff(second)
+        assert not first.patch(second)
+        assert first.length == len(first.pack())
+
+        # Cached sizes follow changes inside a BFLength body
+        first.body.csum_data.payload.value = b"abcdef"
+        assert first.length == len(first.pack())
+        first.body.csum_data.payload.value = b"abc"
+        assert first.length == len(first.pack())
+
+        second.body.csum_data.data.value = 0xAABBCCDE
+        assert [
+            BFDiff("body.csum_data.data", 4, 4, 4, 4),
+            BFDiff("body.csum", 11, 2, 11, 2),
+        ] == first.diff(second)
+        patch = first.patch(second)
+        assert [BFPatch(4, 1, b"\xde"), BFPatch(11, 1, b"\x35")] == patch
+        assert second.pack() == BFContainer.apply_patch(first.pack(), patch)
+
+        # Size changes move later fields and update the length fields
+        second.body.csum_data.payload.value = b"abcdef"
+        second.tail.value.value = 0x1235
+        paths = [entry.path for entry in first.diff(second)]
+        assert [
+            "len",
+            "body",
+            "body.csum_data.data",
+            "body.csum_data.payload",
+            "body.csum",
+            "tail.value",
+        ] == paths
+        tail = first.diff(second)[-1]
+        assert (13, 16) == (tail.offset, tail.other_offset)
+        patch = first.patch(second)
+        assert second.pack() == BFContainer.apply_patch(first.pack(), patch)
+
+        second.tail.extra = BFUInt8()
+        assert "tail" == first.diff(second)[-1].path
+        assert second.pack() == BFContainer.apply_patch(
+            first.pack(), first.patch(second)
+        )
+
+
+class TestFieldNamedLength():
+    """Test fields named like the length property of their container"""
+
+    @staticmethod
+    def _message(value):
+        bf_test = BFContainer()
+        bf_test.hdr = BFContainer()
+        bf_test.hdr.length = BFUInt8(value=value)
+        bf_test.hdr.body = BFLength(BFUInt8(), BFContainer())
+        bf_test.hdr.body.length = BFUInt16(value=value)
+        bf_test.offset = BFOffsetRef(BFUInt8(), "tail")
+        bf_test.tail = BFUInt8(value=2)
+        return bf_test
+
+    def test(self):
+        first = self._message(1)
+        second = self._message(3)
+        assert isinstance(first.hdr.length, BFUInt8)
+        assert b"\x01\x02\x01\x00\x05\x02" == first.pack()
+        assert 6 == first.length
+        assert [
+            BFDiff("hdr.length", 0, 1, 0, 1),
+            BFDiff("hdr.body.length", 2, 2, 2, 2),
+        ] == first.diff(second)
+        assert second.pack() == BFContainer.apply_patch(
+            first.pack(), first.patch(second)
+        )
+
+
+class TestBFSchemaCache():
+    """Test caching templates on disk"""
+
+    @staticmethod
+    def _template():
+        bf_test = BFContainer()
+        bf_test.type = BFSInt8(value=-1)
+        bf_test.len = BFLengthRef(BFUInt8(), "body")
+        bf_test.body = BFLength(BFUInt16(endian=BFEndian.BIG), BFContainer())
+        bf_test.body.csum_data = BFContainer()
+        bf_test.body.csum_data.data = BFUInt32(value=0xAABBCCDD, endian=BFEndian.BIG)
+        bf_test.body.csum_data.payload = BFBuffer(value=b"abc")
+        bf_test.body.csum_data.flags = BFBitField(BFUInt8(), [("a", 3), ("b", 5)])
+        bf_test.body.csum_data.flags.b = 7
+        bf_test.body.csum_data.table = BFArray(
+            BFUInt16, [1, 2], endian=BFEndian.BIG, count_field=BFUInt8()
+        )
+        bf_test.body.csum = BFCallableRef(BFUInt16(), csum, "csum_data")
+        return bf_test
+
+    def test(self):
+        template = self._template()
+        digest, data = BFSchemaCache.dumps(template)
+        loaded = BFSchemaCache.loads(data)
+        assert loaded == template
+        assert loaded.pack() == template.pack()
+        assert digest == BFSchemaCache.dumps(self._template())[0]
+
+        # Loaded templates are ready to use
+        loaded.body.csum_data.data.value = 1
+        assert loaded.pack() != template.pack()
+        assert loaded.body.csum_data.name == "csum_data"
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = BFSchemaCache(directory)
+            assert cache.load(digest) is None
+            assert digest == cache.save(template)
+            assert cache.load(digest) == template
+
+            built = []
+
+            def builder():
+                built.append(1)
+                return self._template()
+
+            assert cache.get("message-v1", builder) == template
+            assert cache.get("message-v1", builder) == template
+            assert len(built) == 1
+
+            # Tampered, stale or malformed files are rebuilt and rewritten
+            path = os.path.join(directory, digest + ".schema")
+            renamed = data.replace(b":csum", b":missing")
+            for data in (renamed, b"garbage"):
+                with open(path, "wb") as handle:
+                    handle.write(data)
+                assert cache.load(digest) is None
+                assert cache.get("message-v1", builder) == template
+                assert cache.load(digest) == template
+            assert len(built) == 3
+
+            header, schema = renamed.split(b"\n", 1)
+            renamed = header.replace(
+                digest.encode(), hashlib.sha256(schema).hexdigest().encode()
+            )
+            with pytest.raises(BFTypeException):
+                BFSchemaCache.loads(renamed + b"\n" + schema)
+            for data in (b"{}", b"[]", b"garbage", b'{"version":2,"digest":""}\n[]'):
+                with pytest.raises(BFTypeException):
+                    BFSchemaCache.loads(data)
+
+        bf_test = BFContainer()
+        bf_test.csum = BFCallableRef(BFUInt8(), lambda data: 0, "data")
+        with pytest.raises(BFTypeException):
+            BFSchemaCache.dumps(bf_test)
+
+
 # class TestPrint():
 #     """Test pretty-print"""
 